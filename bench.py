@@ -0,0 +1,336 @@
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from aiologger import Logger
+
+from client import Client
+from config import bench_arg_parser, configure_bench_logging
+from constants import BASE_DIR, HOST, PORT
+
+MARKER: str = 'bench'
+FILLER: str = 'fill'
+CONNECT_BATCH: int = 100
+SETUP_TIMEOUT: float = 30
+
+
+class BenchStats:
+    def __init__(self) -> None:
+        self.sent: int = 0
+        self.received: int = 0
+        self.latencies: list = []
+
+    def record(self, latency: float) -> None:
+        self.received += 1
+        self.latencies.append(latency)
+
+    def percentiles(self) -> dict:
+        if not self.latencies:
+            return {}
+        latencies = sorted(self.latencies)
+        last = len(latencies) - 1
+        return {
+            name: round(latencies[min(int(last * share), last)] * 1000, 3)
+            for name, share in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99),
+                                ('max', 1.0))
+        }
+
+
+class BenchClient(Client):
+    def __init__(self, username: str, logger: Logger, stats: BenchStats,
+                 server_host: str = HOST, server_port: int = PORT,
+                 compression: bool = False) -> None:
+        super().__init__(username, logger, server_host, server_port,
+                         compression)
+        self.stats: BenchStats = stats
+        self.codes: dict = {}
+        self.channel: Optional[str] = None
+        self.filled: int = 0
+        self.moved_at: float = 0.0
+        self.receive_task: Optional[asyncio.Task] = None
+
+    def on_message(self, message: str) -> None:
+        body = message.rstrip('\n').partition(': ')[2]
+        if body.startswith('(private) '):
+            body = body[len('(private) '):]
+        if body.startswith(f'{MARKER} '):
+            sent_at = float(body.split(' ', 2)[1])
+            if sent_at >= self.moved_at:
+                self.stats.record(time.perf_counter() - sent_at)
+        elif body.startswith(f'{FILLER} '):
+            self.filled += 1
+        elif 'введите команду "/join ' in message:
+            _, channel_name, access_code = message.split('"')[1].split()
+            self.codes[channel_name] = access_code
+
+    async def start(self) -> None:
+        await self.connect()
+        self.receive_task = asyncio.create_task(self.receive())
+
+    async def stop(self) -> None:
+        if self.receive_task is not None:
+            self.receive_task.cancel()
+        if self.connected:
+            self.connected = False
+            await self.disconnect()
+
+    async def send_bench(self, message: str,
+                         recipient: Optional[str] = None) -> None:
+        payload = f'{MARKER} {time.perf_counter():.6f} {message}'
+        self.stats.sent += 1
+        if recipient is not None:
+            await self.send(f'/private {recipient} {payload}')
+        else:
+            await self.send(self.check_message(payload))
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {'general': 0.0, 'channel': 0.0, 'private': 0.0}
+    for part in mix.split(','):
+        kind, weight = part.split('=')
+        weights[kind.strip()] = float(weight)
+    return weights
+
+
+def read_rss(pid: int) -> dict:
+    pids = [pid]
+    children_path = f'/proc/{pid}/task/{pid}/children'
+    if os.path.exists(children_path):
+        with open(children_path) as file:
+            pids.extend(int(child) for child in file.read().split())
+    rss = {'rss_kb': 0, 'peak_rss_kb': 0}
+    for process in pids:
+        try:
+            with open(f'/proc/{process}/status') as file:
+                for line in file:
+                    if line.startswith('VmRSS:'):
+                        rss['rss_kb'] += int(line.split()[1])
+                    elif line.startswith('VmHWM:'):
+                        rss['peak_rss_kb'] += int(line.split()[1])
+        except OSError:
+            return {}
+    return rss
+
+
+async def wait_for_port(host: str, port: int) -> None:
+    deadline = time.monotonic() + SETUP_TIMEOUT
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+        else:
+            writer.close()
+            await writer.wait_closed()
+            return
+
+
+async def wait_until(condition, timeout: float = SETUP_TIMEOUT) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+
+async def start_clients(names: list, logger: Logger, stats: BenchStats,
+                        host: str, port: int,
+                        compression: bool = False) -> list:
+    clients = [BenchClient(name, logger, stats, host, port, compression)
+               for name in names]
+    for start in range(0, len(clients), CONNECT_BATCH):
+        await asyncio.gather(*(client.start() for client in
+                               clients[start:start + CONNECT_BATCH]))
+    return clients
+
+
+async def setup_channels(clients: list, channels: int,
+                         channel_share: float) -> dict:
+    members = clients[:int(len(clients) * channel_share)]
+    rooms: dict = {}
+    for index, client in enumerate(members):
+        rooms.setdefault(f'{MARKER}{index % channels}', []).append(client)
+    for channel_name, room in rooms.items():
+        owner = room[0]
+        await owner.send(owner.check_message(f'/create {channel_name}'))
+        owner.channel = channel_name
+    deadline = time.monotonic() + SETUP_TIMEOUT
+    while time.monotonic() < deadline:
+        missing = [(room[0], member) for channel_name, room in rooms.items()
+                   for member in room[1:] if channel_name not in member.codes]
+        if not missing:
+            break
+        for owner, member in missing:
+            await owner.send(owner.check_message(f'/invite {member.username}'))
+        await wait_until(lambda: all(
+            member.codes for _, member in missing), timeout=1)
+    for channel_name, room in rooms.items():
+        for member in room[1:]:
+            await member.send(member.check_message(
+                f'/join {channel_name} {member.codes[channel_name]}'))
+            member.channel = channel_name
+    return rooms
+
+
+async def churn(client: BenchClient, channel_name: str) -> None:
+    client.channel = None
+    client.moved_at = time.perf_counter()
+    await client.send(client.check_message(f'/leave {channel_name}'))
+    await asyncio.sleep(random.uniform(0.1, 1))
+    client.moved_at = time.perf_counter()
+    await client.send(client.check_message(
+        f'/join {channel_name} {client.codes.get(channel_name, "my")}'))
+    client.channel = channel_name
+
+
+async def generate_traffic(clients: list, rooms: dict, rate: float,
+                           duration: float, mix: dict,
+                           churn_rate: float) -> None:
+    general = [client for client in clients if client.channel is None]
+    kinds = [kind for kind, weight in mix.items() if weight > 0]
+    weights = [mix[kind] for kind in kinds]
+    churn_tasks = set()
+    started = time.perf_counter()
+    sent, churned = 0, 0
+    while True:
+        elapsed = time.perf_counter() - started
+        if elapsed >= duration:
+            break
+        for _ in range(int(elapsed * rate) - sent):
+            sent += 1
+            kind = random.choices(kinds, weights)[0]
+            if kind == 'channel' and rooms:
+                room = random.choice(list(rooms.values()))
+                senders = [member for member in room if member.channel]
+                if senders:
+                    await random.choice(senders).send_bench(str(sent))
+            elif kind == 'private':
+                sender, recipient = random.sample(clients, 2)
+                await sender.send_bench(str(sent), recipient.username)
+            elif general:
+                await random.choice(general).send_bench(str(sent))
+        for _ in range(int(elapsed * churn_rate) - churned):
+            churned += 1
+            candidates = [client for room in rooms.values()
+                          for client in room[1:] if client.channel]
+            if candidates:
+                client = random.choice(candidates)
+                task = asyncio.create_task(churn(client, client.channel))
+                churn_tasks.add(task)
+                task.add_done_callback(churn_tasks.discard)
+        await asyncio.sleep(0.001)
+    await asyncio.gather(*churn_tasks, return_exceptions=True)
+
+
+async def measure_replay(size: int, logger: Logger, host: str, port: int,
+                         compression: bool = False) -> dict:
+    stats = BenchStats()
+    reader = BenchClient(f'replay{size}', logger, stats, host, port,
+                         compression)
+    await reader.start()
+    await asyncio.sleep(0.2)
+    await reader.stop()
+    filler = BenchClient(f'filler{size}', logger, stats, host, port)
+    await filler.start()
+    await filler.send_many(f'{FILLER} {index}' for index in range(size))
+    await asyncio.sleep(0.5)
+    await filler.stop()
+    reader = BenchClient(f'replay{size}', logger, stats, host, port,
+                         compression)
+    started = time.perf_counter()
+    await reader.start()
+    complete = await wait_until(lambda: reader.filled >= size)
+    elapsed = time.perf_counter() - started
+    await reader.stop()
+    return {'history_size': size, 'replayed': reader.filled,
+            'seconds': round(elapsed, 4) if complete else None}
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR, capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    logger = await configure_bench_logging()
+    server = None
+    server_pid = args.server_pid
+    state_dir = tempfile.TemporaryDirectory(prefix='streem-bench-')
+    if args.spawn:
+        server = subprocess.Popen(
+            [sys.executable, str(BASE_DIR / 'streem_server.py'),
+             '-H', args.host, '-p', str(args.port),
+             '--workers', str(args.workers), '--state-dir', state_dir.name,
+             '--accept-rate', '0', '--max-connections', '0',
+             '--user-rate', '0', '--room-rate', '0'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        server_pid = server.pid
+    try:
+        await wait_for_port(args.host, args.port)
+        stats = BenchStats()
+        names = [f'{MARKER}{index}' for index in range(args.clients)]
+        connect_started = time.perf_counter()
+        clients = await start_clients(names, logger, stats, args.host,
+                                      args.port, args.compress)
+        connect_time = time.perf_counter() - connect_started
+        rooms = await setup_channels(clients, args.channels,
+                                     args.channel_share)
+        await asyncio.sleep(1)
+        stats.latencies.clear()
+        stats.received = 0
+        rss_before = read_rss(server_pid) if server_pid else {}
+        started = time.perf_counter()
+        await generate_traffic(clients, rooms, args.rate, args.duration,
+                               parse_mix(args.mix), args.churn)
+        send_time = time.perf_counter() - started
+        await asyncio.sleep(1)
+        rss_after = read_rss(server_pid) if server_pid else {}
+        await asyncio.gather(*(client.stop() for client in clients))
+        replay = []
+        for size in (int(size) for size in args.replay_sizes.split(',')
+                     if size):
+            replay.append(await measure_replay(size, logger, args.host,
+                                               args.port, args.compress))
+        return {
+            'revision': git_revision(),
+            'timestamp': time.time(),
+            'config': vars(args),
+            'connect_seconds': round(connect_time, 3),
+            'sent': stats.sent,
+            'delivered': stats.received,
+            'duration': round(send_time, 3),
+            'sent_per_second': round(stats.sent / send_time, 1),
+            'delivered_per_second': round(stats.received / send_time, 1),
+            'latency_ms': stats.percentiles(),
+            'server_memory': {'before': rss_before, 'after': rss_after},
+            'replay': replay,
+        }
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGTERM)
+            server.wait()
+        state_dir.cleanup()
+        await logger.shutdown()
+
+
+if __name__ == '__main__':
+    parser = bench_arg_parser()
+    args = parser.parse_args()
+    results = asyncio.run(run(args))
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import socket
+from asyncio import StreamReader, StreamWriter
+from typing import Callable
+
+from aiologger import Logger
+
+from constants import BUS_MAX_FRAME_SIZE, READ_BUFFER_SIZE
+from outbox import Outbox
+from protocol import FrameDecoder
+
+READY: bytes = b'{"op": "ready"}\n'
+
+
+class Hub:
+    def __init__(self, sock: socket.socket, workers: int,
+                 logger: Logger) -> None:
+        self.sock: socket.socket = sock
+        self.workers: int = workers
+        self.logger: Logger = logger
+        self.outboxes: list = []
+        self.stopped: asyncio.Event = asyncio.Event()
+
+    async def serve(self) -> None:
+        server = await asyncio.start_unix_server(self.handle_worker,
+                                                 sock=self.sock)
+        async with server:
+            await self.stopped.wait()
+
+    async def handle_worker(self, reader: StreamReader,
+                            writer: StreamWriter) -> None:
+        outbox = Outbox(writer, self.logger, maxsize=0)
+        self.outboxes.append(outbox)
+        if len(self.outboxes) == self.workers:
+            await self.logger.info(f'All {self.workers} workers connected')
+            self.publish(READY)
+        decoder = FrameDecoder(BUS_MAX_FRAME_SIZE)
+        try:
+            while True:
+                data = await reader.read(READ_BUFFER_SIZE)
+                if not data:
+                    break
+                for frame in decoder.feed(data):
+                    if frame is not None:
+                        self.publish(bytes(frame) + b'\n')
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.outboxes.remove(outbox)
+            outbox.close()
+            self.stopped.set()
+        await self.logger.error('Worker disconnected from the bus')
+
+    def publish(self, data: bytes) -> None:
+        for outbox in self.outboxes:
+            outbox.put(data)
+
+
+class Bus:
+    def __init__(self, path: str, logger: Logger,
+                 handler: Callable[[dict], None]) -> None:
+        self.path: str = path
+        self.logger: Logger = logger
+        self.handler: Callable[[dict], None] = handler
+        self.ready: asyncio.Event = asyncio.Event()
+        self.closed: asyncio.Event = asyncio.Event()
+
+    async def connect(self) -> None:
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        self.outbox: Outbox = Outbox(writer, self.logger, maxsize=0)
+        self.task: asyncio.Task = asyncio.create_task(self.listen(reader))
+
+    def publish(self, record: dict) -> None:
+        self.outbox.put(
+            json.dumps(record, ensure_ascii=False).encode() + b'\n')
+
+    async def listen(self, reader: StreamReader) -> None:
+        decoder = FrameDecoder(BUS_MAX_FRAME_SIZE)
+        try:
+            while True:
+                data = await reader.read(READ_BUFFER_SIZE)
+                if not data:
+                    break
+                for frame in decoder.feed(data):
+                    if frame is None:
+                        continue
+                    record = json.loads(bytes(frame))
+                    if record['op'] == 'ready':
+                        self.ready.set()
+                    else:
+                        self.handler(record)
+        except ConnectionError:
+            pass
+        finally:
+            self.closed.set()
+        await self.logger.error('Bus connection lost')
+
+    async def close(self) -> None:
+        self.task.cancel()
+        self.outbox.close()
+        await asyncio.gather(self.task, self.outbox.task,
+                             return_exceptions=True)
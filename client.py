@@ -1,11 +1,16 @@
 import asyncio
-from typing import Optional
+import sys
+import zlib
+from typing import Iterable, Optional
 
 import aioconsole
 from aiologger import Logger
 
 from config import configure_client_logging, client_arg_parser
-from constants import PORT, HOST
+from constants import (ACK_BATCH, ACK_INTERVAL, COMPRESSION, PORT, HOST,
+                       RECONNECT_ATTEMPTS, RECONNECT_DELAY, RELIABLE,
+                       RESEND_DELAY, SCRIPT_LINGER)
+from protocol import encode_frame
 
 
 class Client:
@@ -13,41 +18,191 @@ class Client:
                  username: str,
                  logger: Logger,
                  server_host: str = HOST,
-                 server_port: int = PORT) -> None:
+                 server_port: int = PORT,
+                 compression: bool = False,
+                 reliable: bool = False) -> None:
         self.reader, self.writer = None, None
         self.logger = logger
         self.server_host: str = server_host
         self.server_port: int = server_port
         self.connected: bool = False
+        self.closed: asyncio.Event = asyncio.Event()
         self.error_occurred: bool = False
         self.chat_name: Optional[str] = None
+        self.rejoin: Optional[str] = None
         self.username: str = username
+        self.compression: bool = compression
+        self.decompressor = None
+        self.reliable: bool = reliable
+        self.next_id: int = 1
+        self.unacked: dict = {}
+        self.received: dict = {}
+        self.pending_acks: dict = {}
+        self.ack_count: int = 0
+        self.ack_timer: Optional[asyncio.TimerHandle] = None
+        self.resend_timer: Optional[asyncio.TimerHandle] = None
 
     async def connect(self) -> None:
         self.reader, self.writer = await asyncio.open_connection(
             self.server_host, self.server_port)
         self.connected = True
-        await self.send(self.username)
+        self.decompressor = None
+        handshake = [self.username]
+        if self.reliable:
+            handshake.append(f'+{RELIABLE}')
+        if self.compression:
+            handshake.append(f'+{COMPRESSION}')
+        self.writer.write(encode_frame(' '.join(handshake)))
+        await self.writer.drain()
+        if self.reliable:
+            await self.resume()
+
+    async def resume(self) -> None:
+        line = await self.reader.readline()
+        if line != f'CAPS {RELIABLE}\n'.encode():
+            self.reliable = False
+            if line:
+                await self.dispatch(line.decode())
+            return
+        acked = int((await self.reader.readline()).split()[1])
+        self.acknowledge(acked)
+        self.next_id = max(self.next_id, acked + 1)
+        if self.rejoin is not None:
+            self.writer.write(encode_frame(self.rejoin))
+        if self.unacked:
+            self.writer.writelines(self.unacked_frames())
+            await self.writer.drain()
+
+    def unacked_frames(self) -> list:
+        return [encode_frame(f'#{message_id} {message}')
+                for message_id, message in self.unacked.items()]
+
+    def resend(self) -> None:
+        self.resend_timer = None
+        if not self.unacked or self.writer.is_closing():
+            return
+        self.writer.writelines(self.unacked_frames())
+        self.resend_timer = asyncio.get_running_loop().call_later(
+            RESEND_DELAY, self.resend)
+
+    def frame(self, message: str) -> bytes:
+        if not self.reliable or message == 'quit':
+            return encode_frame(message)
+        message_id = self.next_id
+        self.next_id += 1
+        self.unacked[message_id] = message
+        return encode_frame(f'#{message_id} {message}')
 
     async def send(self, message: str = '') -> None:
-        self.writer.write(message.encode() + b'\n')
+        self.writer.write(self.frame(message))
         await self.writer.drain()
 
-    async def receive(self) -> None:
-        while self.connected:
-            try:
-                data = await self.reader.readline()
-                message = data.decode()
-                if message == 'SERVER_SHUTDOWN\n':
-                    await self.logger.info('Server shutdown.')
-                    self.connected = False
-                else:
-                    print(message.strip())
-            except Exception as e:
-                self.error_occurred = True
-                await self.logger.error(f'An error occurred: {e}')
-                await self.disconnect()
+    def send_nowait(self, message: str) -> None:
+        self.writer.write(self.frame(message))
+
+    async def flush(self) -> None:
+        await self.writer.drain()
+
+    async def send_many(self, messages: Iterable[str]) -> None:
+        self.writer.writelines([self.frame(message) for message in messages])
+        await self.writer.drain()
+
+    def acknowledge(self, acked: int) -> None:
+        while self.unacked:
+            message_id = next(iter(self.unacked))
+            if message_id > acked:
                 break
+            del self.unacked[message_id]
+
+    def on_numbered(self, message: str) -> None:
+        room, seq, *text = message[1:].split(' ', 2)
+        seq = int(seq)
+        if seq > self.received.get(room, 0):
+            self.received[room] = seq
+            if text:
+                self.on_message(text[0])
+        self.pending_acks[room] = self.received[room]
+        self.ack_count += 1
+        if self.ack_count >= ACK_BATCH:
+            self.flush_acks()
+        elif self.ack_timer is None:
+            self.ack_timer = asyncio.get_running_loop().call_later(
+                ACK_INTERVAL, self.flush_acks)
+
+    def flush_acks(self) -> None:
+        if self.ack_timer is not None:
+            self.ack_timer.cancel()
+            self.ack_timer = None
+        if not self.pending_acks or self.writer.is_closing():
+            return
+        fields = ' '.join(f'{room} {seq}'
+                          for room, seq in self.pending_acks.items())
+        self.pending_acks.clear()
+        self.ack_count = 0
+        self.writer.write(encode_frame(f'/ack {fields}'))
+
+    async def reconnect(self) -> bool:
+        for _ in range(RECONNECT_ATTEMPTS):
+            await asyncio.sleep(RECONNECT_DELAY)
+            try:
+                await self.connect()
+            except (OSError, ValueError, IndexError):
+                continue
+            await self.logger.info('Server reconnected.')
+            return True
+        return False
+
+    async def receive(self) -> None:
+        try:
+            while self.connected:
+                try:
+                    data = await self.reader.readline()
+                    if not data and self.reliable and await self.reconnect():
+                        continue
+                    if not data:
+                        await self.logger.info('Server shutdown.')
+                        self.connected = False
+                    elif self.is_compressed(data):
+                        payload = await self.reader.readexactly(int(data[5:]))
+                        for line in self.decompressor.decompress(
+                                payload).splitlines(keepends=True):
+                            await self.dispatch(line.decode())
+                    else:
+                        await self.dispatch(data.decode())
+                except Exception as e:
+                    self.error_occurred = True
+                    await self.logger.error(f'An error occurred: {e}')
+                    await self.disconnect()
+                    break
+        finally:
+            self.closed.set()
+
+    def is_compressed(self, data: bytes) -> bool:
+        return (self.decompressor is not None and data.startswith(b'ZLIB ')
+                and data[5:-1].isdigit())
+
+    async def dispatch(self, message: str) -> None:
+        if message == 'SERVER_SHUTDOWN\n':
+            await self.logger.info('Server shutdown.')
+            self.connected = False
+        elif message == f'CAPS {COMPRESSION}\n':
+            self.decompressor = zlib.decompressobj()
+        elif message == 'PING\n':
+            await self.send('/pong')
+        elif message.startswith('@') and self.reliable:
+            self.on_numbered(message)
+        elif message.startswith('ACK ') and message[4:-1].isdigit():
+            self.acknowledge(int(message[4:]))
+        elif message == 'Too many messages, slow down\n' and self.reliable:
+            self.on_message(message)
+            if self.resend_timer is None:
+                self.resend_timer = asyncio.get_running_loop().call_later(
+                    RESEND_DELAY, self.resend)
+        elif message != 'PONG\n':
+            self.on_message(message)
+
+    def on_message(self, message: str) -> None:
+        print(message.strip())
 
     async def disconnect(self) -> None:
         self.writer.close()
@@ -69,41 +224,72 @@ class Client:
                 return f'{self.chat_name} {message}'
             if channel_message[0] == 'create':
                 self.chat_name = channel_message[1]
+                self.rejoin = f'/join {self.chat_name} my'
             if channel_message[0] == 'join':
                 self.chat_name = channel_message[1]
+                self.rejoin = message
             if channel_message[0] == 'leave':
-                self.chat_name = None
+                self.chat_name = self.rejoin = None
         elif self.chat_name is not None:
             message = f'{self.chat_name} {message}'
         return message
 
 
-async def main(username: str, host: str = HOST, port: int = PORT) -> None:
-    client_logger = await configure_client_logging()
+async def read_console(client: Client, logger: Logger) -> None:
+    while True:
+        try:
+            message = await aioconsole.ainput()
+        except EOFError:
+            await client.send('quit')
+            await client.closed.wait()
+            return
+        except Exception as e:
+            await logger.error(f'Error during the enter: {e}')
+            continue
+        message = client.check_message(message)
+        await client.send(message)
+
+
+def read_script(script: str) -> list:
+    if script == '-':
+        return sys.stdin.read().splitlines()
+    with open(script, encoding='utf-8') as file:
+        return file.read().splitlines()
+
+
+async def run_script(client: Client, script: str,
+                     linger: float = SCRIPT_LINGER) -> None:
+    lines = await asyncio.to_thread(read_script, script)
+    await client.send_many(client.check_message(line) for line in lines
+                           if line.strip())
     try:
-        async with Client(username, client_logger, host, port) as client:
-            await client_logger.info(f'Client {username} started')
+        await asyncio.wait_for(client.closed.wait(), linger)
+    except asyncio.TimeoutError:
+        pass
 
-            async def handle_input():
-                while True:
-                    try:
-                        message = await aioconsole.ainput()
-                    except Exception as e:
-                        await client_logger.error(
-                            f'Error during the enter: {e}')
-                        continue
-                    message = client.check_message(message)
-                    await client.send(message)
 
-            input_task = asyncio.create_task(handle_input())
+async def main(username: str, host: str = HOST, port: int = PORT,
+               script: Optional[str] = None,
+               linger: float = SCRIPT_LINGER,
+               compress: bool = False,
+               reliable: bool = False) -> None:
+    client_logger = await configure_client_logging()
+    try:
+        async with Client(username, client_logger, host, port,
+                          compress, reliable) as client:
+            await client_logger.info(f'Client {username} started')
+            if script is None:
+                input_task = asyncio.create_task(
+                    read_console(client, client_logger))
+            else:
+                input_task = asyncio.create_task(
+                    run_script(client, script, linger))
             receive_task = asyncio.create_task(client.receive())
 
-            while True:
-                if not client.connected or client.error_occurred:
-                    input_task.cancel()
-                    receive_task.cancel()
-                    break
-                await asyncio.sleep(0.01)
+            await asyncio.wait((input_task, receive_task),
+                               return_when=asyncio.FIRST_COMPLETED)
+            input_task.cancel()
+            receive_task.cancel()
 
             if client.error_occurred:
                 client_logger.error('An error occurred in the receive task.')
@@ -116,6 +302,6 @@ if __name__ == "__main__":
     parser = client_arg_parser()
     args = parser.parse_args()
     try:
-        asyncio.run(main(args.username, args.host, args.port))
+        asyncio.run(main(**vars(args)))
     except KeyboardInterrupt:
         pass
@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import json
+from asyncio import StreamReader, StreamWriter
+from bisect import bisect
+from typing import Callable, Iterable
+
+from aiologger import Logger
+
+from constants import (BUS_MAX_FRAME_SIZE, CLUSTER_REPLICAS,
+                       CLUSTER_RETRY_INTERVAL, READ_BUFFER_SIZE)
+from outbox import Outbox
+from protocol import FrameDecoder
+
+
+def parse_address(address: str) -> tuple:
+    host, _, port = address.rpartition(':')
+    return host, int(port)
+
+
+class Ring:
+    def __init__(self, nodes: Iterable[str],
+                 replicas: int = CLUSTER_REPLICAS) -> None:
+        points = sorted((self.hash(f'{node}#{replica}'), node)
+                        for node in nodes for replica in range(replicas))
+        self.points: list = [point for point, _ in points]
+        self.nodes: list = [node for _, node in points]
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(
+            hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+    def owner(self, key: str) -> str:
+        position = bisect(self.points, self.hash(key)) % len(self.points)
+        return self.nodes[position]
+
+
+class Cluster:
+    def __init__(self, node: str, peers: Iterable[str], logger: Logger,
+                 handler: Callable[[dict], None]) -> None:
+        self.node: str = node
+        self.peers: list = sorted(set(peers) - {node})
+        self.ring: Ring = Ring([node, *self.peers])
+        self.logger: Logger = logger
+        self.handler: Callable[[dict], None] = handler
+        self.links: dict = {}
+        self.ready: asyncio.Event = asyncio.Event()
+        self.tasks: list = []
+        self.server = None
+
+    async def start(self) -> None:
+        host, port = parse_address(self.node)
+        self.server = await asyncio.start_server(self.handle_peer, host, port)
+        self.tasks = [asyncio.create_task(self.link(peer))
+                      for peer in self.peers]
+        if not self.peers:
+            self.ready.set()
+
+    async def link(self, peer: str) -> None:
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(
+                    *parse_address(peer))
+            except OSError:
+                await asyncio.sleep(CLUSTER_RETRY_INTERVAL)
+                continue
+            outbox = Outbox(writer, self.logger, maxsize=0)
+            self.links[peer] = outbox
+            await self.logger.info(f'Linked to cluster node {peer}')
+            if len(self.links) == len(self.peers):
+                self.ready.set()
+            try:
+                await reader.read()
+            except ConnectionError:
+                pass
+            del self.links[peer]
+            outbox.close()
+            await self.logger.error(f'Cluster node {peer} disconnected')
+
+    async def handle_peer(self, reader: StreamReader,
+                          writer: StreamWriter) -> None:
+        decoder = FrameDecoder(BUS_MAX_FRAME_SIZE)
+        try:
+            while True:
+                data = await reader.read(READ_BUFFER_SIZE)
+                if not data:
+                    break
+                for frame in decoder.feed(data):
+                    if frame is not None:
+                        self.handler(json.loads(bytes(frame)))
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def owner(self, key: str) -> str:
+        return self.ring.owner(key)
+
+    def send(self, node: str, record: dict) -> bool:
+        if node == self.node:
+            self.handler(record)
+            return True
+        outbox = self.links.get(node)
+        if outbox is None:
+            return False
+        return outbox.put(
+            json.dumps(record, ensure_ascii=False).encode() + b'\n')
+
+    def route(self, record: dict) -> bool:
+        key = record['room'] if 'room' in record else record['user']
+        return self.send(self.owner(key), record)
+
+    async def close(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        outboxes = list(self.links.values())
+        for outbox in outboxes:
+            outbox.close()
+        await asyncio.gather(*self.tasks,
+                             *(outbox.task for outbox in outboxes),
+                             return_exceptions=True)
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
@@ -1,20 +1,40 @@
 import argparse
+from typing import Optional, Union
 
 from aiologger import Logger
 from aiologger.formatters.base import Formatter
 from aiologger.handlers.files import AsyncFileHandler
 
-from constants import BASE_DIR, LOG_FORMAT, PORT
+from constants import (ACCEPT_RATE, BASE_DIR, HEARTBEAT_INTERVAL,
+                       HISTORY_MAX_AGE, HISTORY_MAX_SIZE, HISTORY_STORES,
+                       IDLE_TIMEOUT, LOG_BACKUPS, LOG_FORMAT, LOG_LEVELS,
+                       LOG_MAX_BYTES, LOG_MODES, MAX_CONNECTIONS,
+                       METRICS_HOST, METRICS_PORT, OUTBOUND_BUFFER_SIZE,
+                       PORT, ROOM_BURST, ROOM_RATE, SCRIPT_LINGER,
+                       SLOW_CONSUMER_POLICIES,
+                       SLOW_CONSUMER_POLICY, SLOW_CONSUMER_TIMEOUT,
+                       STATE_DIR, USER_BURST, USER_RATE, WRITE_BUFFER_HIGH,
+                       WRITE_BUFFER_LOW)
+from threadlog import ThreadLogger, parse_samples
 
 
-async def configure_server_logging() -> Logger:
-    log_format = LOG_FORMAT
-    formatter = Formatter(fmt=log_format)
-    logger = Logger.with_default_handlers(name="server", level="INFO",
-                                          formatter=formatter)
+async def configure_server_logging(
+        mode: str = 'async', level: str = 'INFO',
+        samples: Optional[str] = None, max_bytes: int = LOG_MAX_BYTES,
+        backups: int = LOG_BACKUPS,
+        worker_id: Optional[int] = None) -> Union[Logger, ThreadLogger]:
     log_dir = BASE_DIR / 'logs'
     log_dir.mkdir(exist_ok=True)
     log_file = log_dir / 'server.log'
+    if mode == 'thread':
+        if worker_id is not None:
+            log_file = log_dir / f'server.{worker_id}.log'
+        return ThreadLogger("server", log_file, level,
+                            parse_samples(samples), max_bytes, backups)
+    log_format = LOG_FORMAT
+    formatter = Formatter(fmt=log_format)
+    logger = Logger.with_default_handlers(name="server", level=level,
+                                          formatter=formatter)
     file_handler = AsyncFileHandler(filename=str(log_file), mode="a")
     file_handler.formatter = formatter
     logger.add_handler(file_handler)
@@ -35,12 +55,111 @@ async def configure_client_logging() -> Logger:
     return logger
 
 
+async def configure_bench_logging() -> Logger:
+    formatter = Formatter(fmt=LOG_FORMAT)
+    logger = Logger(name="bench", level="INFO")
+    log_dir = BASE_DIR / 'logs'
+    log_dir.mkdir(exist_ok=True)
+    log_file = log_dir / 'bench.log'
+    file_handler = AsyncFileHandler(filename=str(log_file), mode="a")
+    file_handler.formatter = formatter
+    logger.add_handler(file_handler)
+    return logger
+
+
 def server_arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description='Streem server.')
     parser.add_argument('-H', '--host', type=str, default='127.0.0.1',
                         help='Host to run the server on.')
     parser.add_argument('-p', '--port', type=int, default=PORT,
                         help='Port to run the server on.')
+    parser.add_argument('--history-size', type=int,
+                        default=HISTORY_MAX_SIZE,
+                        help='Maximum number of messages kept per chat.')
+    parser.add_argument('--history-age', type=int, default=HISTORY_MAX_AGE,
+                        help='Lifetime of stored messages in seconds.')
+    parser.add_argument('--history-store', type=str, default='memory',
+                        choices=HISTORY_STORES,
+                        help='Keep chat history in memory or in segment '
+                             'files under the state directory.')
+    parser.add_argument('--state-dir', type=str, default=str(STATE_DIR),
+                        help='Directory for the journal and snapshots.')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Number of worker processes sharing the port.')
+    parser.add_argument('--metrics-host', type=str, default=METRICS_HOST,
+                        help='Address of the Prometheus metrics endpoint.')
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help='Port of the Prometheus metrics endpoint '
+                             '(0, the default, disables it).')
+    parser.add_argument('--heartbeat-interval', type=float,
+                        default=HEARTBEAT_INTERVAL,
+                        help='Seconds of silence before a client is pinged.')
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help='Seconds of silence before a client is '
+                             'disconnected (0 disables it).')
+    parser.add_argument('--user-rate', type=float, default=USER_RATE,
+                        help='Messages per second allowed for one client '
+                             '(0, the default, disables the limit).')
+    parser.add_argument('--user-burst', type=float, default=USER_BURST,
+                        help='Burst of messages allowed for one client.')
+    parser.add_argument('--room-rate', type=float, default=ROOM_RATE,
+                        help='Messages per second allowed in one chat '
+                             '(0 disables the limit).')
+    parser.add_argument('--room-burst', type=float, default=ROOM_BURST,
+                        help='Burst of messages allowed in one chat.')
+    parser.add_argument('--max-connections', type=int,
+                        default=MAX_CONNECTIONS,
+                        help='Maximum number of open connections per worker '
+                             '(0 disables the limit).')
+    parser.add_argument('--accept-rate', type=float, default=ACCEPT_RATE,
+                        help='New connections accepted per second per worker '
+                             '(0 disables the limit).')
+    parser.add_argument('--outbound-buffer', type=int,
+                        default=OUTBOUND_BUFFER_SIZE,
+                        help='Bytes queued per client before the '
+                             'slow-consumer policy applies.')
+    parser.add_argument('--write-buffer-high', type=int,
+                        default=WRITE_BUFFER_HIGH,
+                        help='Transport high water mark in bytes.')
+    parser.add_argument('--write-buffer-low', type=int,
+                        default=WRITE_BUFFER_LOW,
+                        help='Transport low water mark in bytes.')
+    parser.add_argument('--slow-consumer-policy', type=str,
+                        default=SLOW_CONSUMER_POLICY,
+                        choices=SLOW_CONSUMER_POLICIES,
+                        help='What to do when a client stops reading.')
+    parser.add_argument('--slow-consumer-timeout', type=float,
+                        default=SLOW_CONSUMER_TIMEOUT,
+                        help='Seconds a client may stay blocked before the '
+                             'disconnect policy closes it.')
+    parser.add_argument('--cluster-listen', type=str, default=None,
+                        help='HOST:PORT this node accepts cluster peers on '
+                             '(enables cluster mode).')
+    parser.add_argument('--peers', type=str, default=None,
+                        help='Comma-separated HOST:PORT list of the other '
+                             'cluster nodes.')
+    parser.add_argument('--handoff', type=str, default=None,
+                        help='Unix socket for hot restarts: take over the '
+                             'server listening on it, then accept the next '
+                             'takeover.')
+    parser.add_argument('--handoff-listener-only', action='store_true',
+                        help='Take over only the listening socket; clients '
+                             'of the old process reconnect.')
+    parser.add_argument('--log-mode', type=str, default='async',
+                        choices=LOG_MODES,
+                        help='Write logs from the event loop or from a '
+                             'background thread in batches.')
+    parser.add_argument('--log-level', type=str, default='INFO',
+                        choices=LOG_LEVELS,
+                        help='Lowest level of messages written to the log.')
+    parser.add_argument('--log-sample', type=str, default=None,
+                        help='Log one of every N frequent events in thread '
+                             'mode, e.g. "connect=100,reject=1000".')
+    parser.add_argument('--log-max-bytes', type=int, default=LOG_MAX_BYTES,
+                        help='Log file size that triggers rotation in '
+                             'thread mode (0 disables rotation).')
+    parser.add_argument('--log-backups', type=int, default=LOG_BACKUPS,
+                        help='Rotated log files kept in thread mode.')
     return parser
 
 
@@ -52,4 +171,50 @@ def client_arg_parser() -> argparse.ArgumentParser:
                         help='Host to connect to.')
     parser.add_argument('-p', '--port', type=int, default=PORT,
                         help='Port to connect to.')
+    parser.add_argument('--script', type=str, default=None,
+                        help='Send the lines of this file ("-" for stdin) '
+                             'instead of reading the console.')
+    parser.add_argument('--linger', type=float, default=SCRIPT_LINGER,
+                        help='Seconds to keep receiving after a script.')
+    parser.add_argument('--compress', action='store_true',
+                        help='Ask the server for zlib-compressed history.')
+    parser.add_argument('--reliable', action='store_true',
+                        help='Number messages, track acknowledgements and '
+                             'resend the gaps after reconnecting.')
+    return parser
+
+
+def bench_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Streem load benchmark.')
+    parser.add_argument('-H', '--host', type=str, default='127.0.0.1',
+                        help='Host of the server under test.')
+    parser.add_argument('-p', '--port', type=int, default=PORT,
+                        help='Port of the server under test.')
+    parser.add_argument('--spawn', action='store_true',
+                        help='Start a local server on --port for the run.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes of the spawned server.')
+    parser.add_argument('--server-pid', type=int, default=None,
+                        help='PID of an external server for RSS readings.')
+    parser.add_argument('-c', '--clients', type=int, default=1000,
+                        help='Number of simulated clients.')
+    parser.add_argument('--channels', type=int, default=10,
+                        help='Number of channels to create.')
+    parser.add_argument('--channel-share', type=float, default=0.5,
+                        help='Share of clients that join a channel.')
+    parser.add_argument('-d', '--duration', type=float, default=10,
+                        help='Length of the traffic phase in seconds.')
+    parser.add_argument('-r', '--rate', type=float, default=500,
+                        help='Messages sent per second across all clients.')
+    parser.add_argument('--mix', type=str, default='general=5,channel=4,private=1',
+                        help='Relative weights of general, channel and private traffic.')
+    parser.add_argument('--churn', type=float, default=5,
+                        help='Channel leave/join operations per second.')
+    parser.add_argument('--compress', action='store_true',
+                        help='Negotiate zlib compression for all clients.')
+    parser.add_argument('--replay-sizes', type=str, default='100,1000,10000',
+                        help='History sizes to measure reconnect replay for.')
+    parser.add_argument('-o', '--output', type=str,
+                        default='bench_results.json',
+                        help='File to write the JSON results to.')
     return parser
@@ -2,6 +2,61 @@ from pathlib import Path
 
 BASE_DIR: Path = Path(__file__).parent
 LOG_FORMAT: str = '%(asctime)s - [%(levelname)s] - %(message)s'
+LOG_MODES: tuple = ('async', 'thread')
+LOG_LEVELS: tuple = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+LOG_MAX_BYTES: int = 10 * 1024 * 1024
+LOG_BACKUPS: int = 5
+LOG_FLUSH_INTERVAL: float = 0.2
+LOG_BATCH_SIZE: int = 1000
 PORT: int = 8000
 HOST: str = '127.0.0.1'
 VALUE_FOR_RANDOMIZER: int = 6
+OUTBOUND_QUEUE_SIZE: int = 1000
+HISTORY_MAX_SIZE: int = 10000
+HISTORY_MAX_AGE: int = 60 * 60
+LAST_MESSAGES_COUNT: int = 20
+HISTORY_PAGE_SIZE: int = 100
+GENERAL_ROOM: str = 'general'
+STATE_DIR: Path = BASE_DIR / 'state'
+JOURNAL_FLUSH_INTERVAL: float = 0.05
+JOURNAL_SNAPSHOT_INTERVAL: float = 5 * 60
+JOURNAL_SNAPSHOT_RECORDS: int = 10000
+READ_BUFFER_SIZE: int = 256 * 1024
+MAX_FRAME_SIZE: int = 64 * 1024
+BUS_MAX_FRAME_SIZE: int = 1024 * 1024
+METRICS_HOST: str = '127.0.0.1'
+METRICS_PORT: int = 0
+LOOP_LAG_INTERVAL: float = 0.5
+LATENCY_BUCKETS: tuple = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                          0.1, 0.25, 0.5, 1.0, 2.5)
+SCRIPT_LINGER: float = 1.0
+HEARTBEAT_INTERVAL: float = 30
+IDLE_TIMEOUT: float = 90
+USER_RATE: float = 0
+USER_BURST: float = 20
+ROOM_RATE: float = 500
+ROOM_BURST: float = 1000
+MAX_CONNECTIONS: int = 10000
+ACCEPT_RATE: float = 1000
+OUTBOUND_BUFFER_SIZE: int = 4 * 1024 * 1024
+WRITE_BUFFER_HIGH: int = 256 * 1024
+WRITE_BUFFER_LOW: int = 64 * 1024
+SLOW_CONSUMER_POLICIES: tuple = ('drop-new', 'drop-oldest', 'disconnect')
+SLOW_CONSUMER_POLICY: str = 'drop-new'
+SLOW_CONSUMER_TIMEOUT: float = 10
+COMPRESS_MIN_SIZE: int = 1024
+COMPRESSION: str = 'zlib'
+HISTORY_STORES: tuple = ('memory', 'disk')
+HISTORY_CACHE_SIZE: int = 1000
+HISTORY_SEGMENT_SIZE: int = 4 * 1024 * 1024
+HISTORY_INDEX_INTERVAL: int = 64
+CLUSTER_REPLICAS: int = 100
+CLUSTER_RETRY_INTERVAL: float = 0.5
+HANDOFF_TIMEOUT: float = 5
+HANDOFF_FD_BATCH: int = 250
+RELIABLE: str = 'ack'
+ACK_BATCH: int = 100
+ACK_INTERVAL: float = 0.2
+RECONNECT_ATTEMPTS: int = 5
+RECONNECT_DELAY: float = 1.0
+RESEND_DELAY: float = 1.0
@@ -0,0 +1,70 @@
+import asyncio
+import pickle
+import socket
+import struct
+from typing import Optional
+
+from constants import HANDOFF_FD_BATCH
+
+HEADER: struct.Struct = struct.Struct('<QI')
+COUNT: struct.Struct = struct.Struct('<I')
+LISTENER_ONLY: bytes = b'L'
+WITH_SESSIONS: bytes = b'S'
+ACK: bytes = b'\x01'
+
+
+def receive_exactly(conn: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = conn.recv(min(size - len(data), 1024 * 1024))
+        if not chunk:
+            raise ConnectionError('Handoff connection closed')
+        data += chunk
+    return bytes(data)
+
+
+def send_handoff(conn: socket.socket, state: dict, fds: list) -> None:
+    payload = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+    conn.sendall(HEADER.pack(len(payload), len(fds)) + payload)
+    for start in range(0, len(fds), HANDOFF_FD_BATCH):
+        batch = fds[start:start + HANDOFF_FD_BATCH]
+        socket.send_fds(conn, [COUNT.pack(len(batch))], batch)
+    if conn.recv(1) != ACK:
+        raise ConnectionError('Handoff was not acknowledged')
+
+
+def receive_handoff(conn: socket.socket) -> dict:
+    size, count = HEADER.unpack(receive_exactly(conn, HEADER.size))
+    state = pickle.loads(receive_exactly(conn, size))
+    fds = []
+    while len(fds) < count:
+        data, batch, _, _ = socket.recv_fds(conn, COUNT.size,
+                                            HANDOFF_FD_BATCH)
+        if not data:
+            raise ConnectionError('Handoff connection closed')
+        fds.extend(batch)
+    state['fds'] = fds
+    return state
+
+
+def request_takeover(path: str, sessions: bool) -> Optional[dict]:
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            conn.connect(path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+        conn.sendall(WITH_SESSIONS if sessions else LISTENER_ONLY)
+        state = receive_handoff(conn)
+        conn.sendall(ACK)
+        while conn.recv(4096):
+            pass
+        return state
+    finally:
+        conn.close()
+
+
+async def take_over(path: Optional[str], sessions: bool) -> Optional[dict]:
+    if path is None:
+        return None
+    return await asyncio.to_thread(request_takeover, path, sessions)
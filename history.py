@@ -0,0 +1,89 @@
+import sys
+import time
+from collections import deque
+from itertools import islice
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from constants import HISTORY_MAX_AGE, HISTORY_MAX_SIZE
+
+
+class Message(NamedTuple):
+    seq: int
+    time: float
+    name: str
+    data: bytes
+
+    def row(self) -> list:
+        return [self.seq, self.data.decode(), self.time, self.name]
+
+    @classmethod
+    def from_row(cls, row: list) -> 'Message':
+        seq, text, send_time, name = row
+        return cls(seq, send_time, sys.intern(name), text.encode())
+
+
+class History:
+    persistent: bool = False
+
+    def __init__(self, messages: Iterable = (), next_seq: int = 1,
+                 max_size: int = HISTORY_MAX_SIZE,
+                 max_age: float = HISTORY_MAX_AGE) -> None:
+        self.messages: deque = deque(messages, maxlen=max_size)
+        self.next_seq: int = next_seq
+        if self.messages:
+            self.next_seq = max(next_seq, self.messages[-1].seq + 1)
+        self.max_age: float = max_age
+        self.trim()
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self.messages)
+
+    @property
+    def first_seq(self) -> int:
+        return self.messages[0].seq if self.messages else self.next_seq
+
+    @property
+    def last_seq(self) -> int:
+        return self.next_seq - 1
+
+    def append(self, data: bytes, send_time: float, name: str,
+               seq: Optional[int] = None) -> Message:
+        if seq is None:
+            seq = self.next_seq
+        self.next_seq = seq + 1
+        message = Message(seq, send_time, sys.intern(name), data)
+        self.messages.append(message)
+        self.trim(send_time)
+        return message
+
+    def trim(self, now: Optional[float] = None) -> None:
+        deadline = (time.time() if now is None else now) - self.max_age
+        messages = self.messages
+        while messages and messages[0].time <= deadline:
+            messages.popleft()
+
+    def rewind(self, next_seq: int) -> None:
+        while self.messages and self.messages[-1].seq >= next_seq:
+            self.messages.pop()
+        self.next_seq = next_seq
+
+    def tail(self, count: int) -> list:
+        self.trim()
+        recent = list(islice(reversed(self.messages), count))
+        recent.reverse()
+        return recent
+
+    def since(self, seq: int, limit: Optional[int] = None) -> list:
+        self.trim()
+        size = len(self.messages)
+        start = min(max(seq + 1 - self.first_seq, 0), size)
+        stop = size if limit is None else min(start + max(limit, 0), size)
+        if size - start < stop:
+            page = list(islice(reversed(self.messages), size - stop,
+                               size - start))
+            page.reverse()
+            return page
+        return list(islice(self.messages, start, stop))
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import Callable, Optional, TextIO
+
+from aiologger import Logger
+
+from constants import (JOURNAL_FLUSH_INTERVAL, JOURNAL_SNAPSHOT_INTERVAL,
+                       JOURNAL_SNAPSHOT_RECORDS)
+
+SNAPSHOT_FILE: str = 'snapshot.json'
+
+
+def log_path(directory: Path, generation: int) -> Path:
+    return directory / f'journal.{generation:08d}.log'
+
+
+def log_generations(directory: Path) -> list:
+    return sorted(int(path.name.split('.')[1])
+                  for path in directory.glob('journal.*.log'))
+
+
+def sync_files(fds: list) -> None:
+    for fd in fds:
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def read_journal(directory: Path) -> tuple:
+    directory.mkdir(parents=True, exist_ok=True)
+    state, generation = None, 0
+    snapshot_path = directory / SNAPSHOT_FILE
+    if snapshot_path.exists():
+        with open(snapshot_path, encoding='utf-8') as file:
+            snapshot = json.load(file)
+        state, generation = snapshot['state'], snapshot['generation']
+    records = []
+    generations = [gen for gen in log_generations(directory)
+                   if gen >= generation]
+    for gen in generations:
+        with open(log_path(directory, gen), encoding='utf-8') as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+    return state, records, max(generations, default=generation)
+
+
+class Journal:
+    def __init__(self, directory: Path, logger: Logger,
+                 flush_interval: float = JOURNAL_FLUSH_INTERVAL,
+                 snapshot_interval: float = JOURNAL_SNAPSHOT_INTERVAL,
+                 snapshot_records: int = JOURNAL_SNAPSHOT_RECORDS) -> None:
+        self.directory: Path = Path(directory)
+        self.logger: Logger = logger
+        self.flush_interval: float = flush_interval
+        self.snapshot_interval: float = snapshot_interval
+        self.snapshot_records: int = snapshot_records
+        self.generation: int = 0
+        self.file: Optional[TextIO] = None
+        self.pending: list = []
+        self.records: int = 0
+        self.snapshot_time: float = time.monotonic()
+        self.lock: asyncio.Lock = asyncio.Lock()
+
+    def recover(self, recovered: Optional[tuple] = None) -> tuple:
+        if recovered is None:
+            recovered = read_journal(self.directory)
+        state, records, generation = recovered
+        self.records = len(records)
+        self.generation = generation + 1
+        self.file = open(log_path(self.directory, self.generation), 'a',
+                         encoding='utf-8')
+        return state, records
+
+    def append(self, record: dict) -> None:
+        self.pending.append(json.dumps(record, ensure_ascii=False))
+
+    def take_pending(self) -> str:
+        pending, self.pending = self.pending, []
+        self.records += len(pending)
+        return ''.join(line + '\n' for line in pending)
+
+    @staticmethod
+    def write(file: TextIO, data: str) -> None:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+    async def flush(self) -> None:
+        async with self.lock:
+            if self.pending:
+                await asyncio.to_thread(self.write, self.file,
+                                        self.take_pending())
+
+    async def snapshot(self, get_state: Callable[[], dict],
+                       checkpoint: Optional[Callable[[], list]] = None
+                       ) -> None:
+        async with self.lock:
+            state, data = get_state(), self.take_pending()
+            fds = checkpoint() if checkpoint is not None else []
+            old_file = self.file
+            self.generation += 1
+            self.file = open(log_path(self.directory, self.generation), 'a',
+                             encoding='utf-8')
+            self.records = 0
+            self.snapshot_time = time.monotonic()
+            await asyncio.to_thread(self.write_snapshot, old_file, data,
+                                    state, self.generation, fds)
+        await self.logger.info(
+            f'Journal snapshot written, generation {self.generation}')
+
+    def write_snapshot(self, old_file: TextIO, data: str, state: dict,
+                       generation: int, fds: list) -> None:
+        sync_files(fds)
+        self.write(old_file, data)
+        old_file.close()
+        snapshot_path = self.directory / SNAPSHOT_FILE
+        temp_path = snapshot_path.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({'generation': generation, 'state': state}, file,
+                      ensure_ascii=False)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, snapshot_path)
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        for gen in log_generations(self.directory):
+            if gen < generation:
+                log_path(self.directory, gen).unlink()
+
+    def snapshot_due(self) -> bool:
+        if self.records + len(self.pending) >= self.snapshot_records:
+            return True
+        return bool(self.records or self.pending) and (
+            time.monotonic() - self.snapshot_time >= self.snapshot_interval)
+
+    async def run(self, get_state: Callable[[], dict],
+                  checkpoint: Optional[Callable[[], list]] = None) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self.snapshot_due():
+                await self.snapshot(get_state, checkpoint)
+            else:
+                await self.flush()
+
+    async def close(self) -> None:
+        await self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,171 @@
+import asyncio
+import time
+from asyncio import StreamReader, StreamWriter
+from typing import Callable, Iterable
+
+from aiologger import Logger
+
+from constants import LATENCY_BUCKETS, LOOP_LAG_INTERVAL
+
+CONTENT_TYPE: str = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(f'{name}="{escape(str(value))}"'
+                     for name, value in labels)
+    return '{' + pairs + '}'
+
+
+def header(name: str, documentation: str, kind: str) -> list:
+    return [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+
+
+def gauge(name: str, documentation: str, values: dict) -> list:
+    lines = header(name, documentation, 'gauge')
+    for labels, value in values.items():
+        lines.append(f'{name}{format_labels(labels)} {value}')
+    return lines
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name: str = name
+        self.documentation: str = documentation
+        self.values: dict = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def expose(self) -> list:
+        lines = header(self.name, self.documentation, 'counter')
+        for labels, value in (self.values or {(): 0}).items():
+            lines.append(f'{self.name}{format_labels(labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str,
+                 buckets: tuple = LATENCY_BUCKETS) -> None:
+        self.name: str = name
+        self.documentation: str = documentation
+        self.buckets: tuple = buckets
+        self.values: dict = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        counts = self.values.get(key)
+        if counts is None:
+            counts = self.values[key] = [0] * len(self.buckets) + [0, 0.0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        counts[-2] += 1
+        counts[-1] += value
+
+    def expose(self) -> list:
+        lines = header(self.name, self.documentation, 'histogram')
+        for labels, counts in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket_labels = format_labels(labels + (('le', bound),))
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            inf_labels = format_labels(labels + (('le', '+Inf'),))
+            lines.append(f'{self.name}_bucket{inf_labels} {counts[-2]}')
+            lines.append(f'{self.name}_count{format_labels(labels)} {counts[-2]}')
+            lines.append(f'{self.name}_sum{format_labels(labels)} {counts[-1]}')
+        return lines
+
+
+class Metrics:
+    def __init__(self, logger: Logger) -> None:
+        self.logger: Logger = logger
+        self.messages_in: Counter = Counter(
+            'streem_messages_received_total',
+            'Frames received from clients.')
+        self.messages_out: Counter = Counter(
+            'streem_messages_sent_total',
+            'Messages queued for delivery to clients.')
+        self.messages_dropped: Counter = Counter(
+            'streem_messages_dropped_total',
+            'Messages dropped because an outbound queue was full.')
+        self.slow_consumer: Counter = Counter(
+            'streem_slow_consumer_total',
+            'Times a slow-consumer policy fired, by policy.')
+        self.compression: Counter = Counter(
+            'streem_compression_bytes_total',
+            'Bytes passed through zlib compression, before and after.')
+        self.rate_limited: Counter = Counter(
+            'streem_rate_limited_total',
+            'Connections and messages rejected by rate limits.')
+        self.command_latency: Histogram = Histogram(
+            'streem_command_duration_seconds',
+            'Time spent handling a chat command.')
+        self.loop_lag: Histogram = Histogram(
+            'streem_event_loop_lag_seconds',
+            'Delay between a scheduled event loop wakeup and its execution.')
+        self.collectors: list = []
+
+    def add_collector(self, collector: Callable[[], Iterable]) -> None:
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.messages_in, self.messages_out,
+                       self.messages_dropped, self.slow_consumer,
+                       self.rate_limited, self.compression,
+                       self.command_latency,
+                       self.loop_lag):
+            lines.extend(metric.expose())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+    async def monitor_loop(self,
+                           interval: float = LOOP_LAG_INTERVAL) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag.observe(
+                max(time.perf_counter() - started - interval, 0))
+
+    async def handle_request(self, reader: StreamReader,
+                             writer: StreamWriter) -> None:
+        try:
+            request = await reader.readuntil(b'\r\n\r\n')
+            method, path, *_ = request.split(b' ', 2)
+            if method == b'GET' and path.split(b'?')[0] in (b'/', b'/metrics'):
+                status, body = '200 OK', self.render().encode()
+            else:
+                status, body = '404 Not Found', b'Not Found\n'
+            writer.write(
+                f'HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'
+                .encode() + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str, port: int) -> None:
+        self.server: asyncio.Server = await asyncio.start_server(
+            self.handle_request, host, port)
+        self.monitor: asyncio.Task = asyncio.create_task(self.monitor_loop())
+        await self.logger.info(
+            f'Metrics available on http://{host}:{port}/metrics')
+
+    async def close(self) -> None:
+        self.monitor.cancel()
+        self.server.close()
+        await self.server.wait_closed()
@@ -0,0 +1,158 @@
+import asyncio
+import time
+import zlib
+from asyncio import StreamWriter
+from typing import Optional, Union
+
+from aiologger import Logger
+
+from constants import (COMPRESS_MIN_SIZE, OUTBOUND_BUFFER_SIZE,
+                       OUTBOUND_QUEUE_SIZE, SLOW_CONSUMER_POLICY,
+                       SLOW_CONSUMER_TIMEOUT)
+from metrics import Metrics
+
+COMPRESS: object = object()
+
+
+def payload_size(data: Union[bytes, list]) -> int:
+    if isinstance(data, list):
+        return sum(len(chunk) for chunk in data)
+    return len(data)
+
+
+class Outbox:
+    def __init__(self, writer: StreamWriter, logger: Logger,
+                 maxsize: int = OUTBOUND_QUEUE_SIZE,
+                 metrics: Optional[Metrics] = None,
+                 max_bytes: int = OUTBOUND_BUFFER_SIZE,
+                 policy: str = SLOW_CONSUMER_POLICY,
+                 stall_timeout: float = SLOW_CONSUMER_TIMEOUT,
+                 write_buffer: Optional[tuple] = None) -> None:
+        self.writer: StreamWriter = writer
+        self.logger: Logger = logger
+        self.metrics: Optional[Metrics] = metrics
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.max_bytes: int = max_bytes if maxsize else 0
+        self.policy: str = policy
+        self.stall_timeout: float = stall_timeout
+        self.queued_bytes: int = 0
+        self.stalled_since: Optional[float] = None
+        self.compressor = None
+        self.closing: bool = False
+        self.dropped: int = 0
+        if write_buffer is not None:
+            high, low = write_buffer
+            writer.transport.set_write_buffer_limits(high, low)
+        self.task: asyncio.Task = asyncio.create_task(self.run())
+
+    def put(self, data: Union[bytes, list]) -> bool:
+        if self.closing:
+            return False
+        size = payload_size(data)
+        if self.overflows(size) and not self.make_room(size):
+            return False
+        self.queue.put_nowait(data)
+        self.queued_bytes += size
+        if self.metrics is not None:
+            self.metrics.messages_out.inc()
+        return True
+
+    def overflows(self, size: int) -> bool:
+        if self.queue.full():
+            return True
+        if not (self.max_bytes and self.queued_bytes):
+            return False
+        return self.queued_bytes + size > self.max_bytes
+
+    def make_room(self, size: int) -> bool:
+        if self.policy == 'drop-oldest':
+            while self.overflows(size) and not self.queue.empty():
+                oldest = self.queue.get_nowait()
+                if oldest is COMPRESS:
+                    self.compressor = zlib.compressobj()
+                    continue
+                self.queued_bytes -= payload_size(oldest)
+                self.drop('drop-oldest')
+            return True
+        if self.policy == 'disconnect' and self.stalled_since is not None and (
+                time.monotonic() - self.stalled_since >= self.stall_timeout):
+            self.disconnect()
+            return False
+        self.drop('drop-new')
+        return False
+
+    def drop(self, policy: str) -> None:
+        self.dropped += 1
+        if self.metrics is not None:
+            self.metrics.messages_dropped.inc()
+            self.metrics.slow_consumer.inc(policy=policy)
+
+    def disconnect(self) -> None:
+        if self.metrics is not None:
+            self.metrics.slow_consumer.inc(policy='disconnect')
+        self.logger.info('Disconnecting a slow consumer')
+        self.closing = True
+        self.writer.transport.abort()
+
+    def flushed(self) -> bool:
+        return (self.queue.empty() and self.stalled_since is None
+                and not self.writer.transport.get_write_buffer_size())
+
+    def start_compression(self) -> None:
+        try:
+            self.queue.put_nowait(COMPRESS)
+        except asyncio.QueueFull:
+            pass
+
+    def write(self, batch: list) -> None:
+        if not batch:
+            return
+        size = sum(len(chunk) for chunk in batch)
+        if self.compressor is None or size < COMPRESS_MIN_SIZE:
+            self.writer.writelines(batch)
+            return
+        payload = self.compressor.compress(b''.join(batch))
+        payload += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.writer.writelines([b'ZLIB %d\n' % len(payload), payload])
+        if self.metrics is not None:
+            self.metrics.compression.inc(size, stage='raw')
+            self.metrics.compression.inc(len(payload), stage='compressed')
+
+    def close(self) -> None:
+        if self.closing:
+            return
+        self.closing = True
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+    async def run(self) -> None:
+        try:
+            while not (self.closing and self.queue.empty()):
+                data = await self.queue.get()
+                if data is None:
+                    break
+                batch = []
+                while data is not None:
+                    if data is COMPRESS:
+                        self.write(batch)
+                        batch = []
+                        self.compressor = zlib.compressobj()
+                    else:
+                        self.queued_bytes -= payload_size(data)
+                        if isinstance(data, list):
+                            batch.extend(data)
+                        else:
+                            batch.append(data)
+                    if self.queue.empty():
+                        break
+                    data = self.queue.get_nowait()
+                self.write(batch)
+                self.stalled_since = time.monotonic()
+                await self.writer.drain()
+                self.stalled_since = None
+        except ConnectionError as e:
+            await self.logger.info(f'Outbound stream closed: {e}')
+        finally:
+            self.writer.close()
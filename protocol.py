@@ -0,0 +1,46 @@
+from typing import Optional
+
+from constants import MAX_FRAME_SIZE
+
+
+class FrameDecoder:
+    def __init__(self, max_size: int = MAX_FRAME_SIZE) -> None:
+        self.max_size: int = max_size
+        self.buffer: bytearray = bytearray()
+        self.discarding: bool = False
+
+    def feed(self, data: bytes) -> list:
+        frames: list = []
+        if self.buffer:
+            self.buffer += data
+            data = bytes(self.buffer)
+            self.buffer.clear()
+        view = memoryview(data)
+        start = 0
+        end = data.find(b'\n')
+        while end >= 0:
+            if self.discarding:
+                self.discarding = False
+            else:
+                frames.append(self.frame(view, start, end))
+            start = end + 1
+            end = data.find(b'\n', start)
+        if not self.discarding and start < len(data):
+            if len(data) - start > self.max_size:
+                self.discarding = True
+                frames.append(None)
+            else:
+                self.buffer += view[start:]
+        return frames
+
+    def frame(self, view: memoryview, start: int,
+              end: int) -> Optional[memoryview]:
+        if end > start and view[end - 1] == 13:
+            end -= 1
+        if end - start > self.max_size:
+            return None
+        return view[start:end]
+
+
+def encode_frame(text: str) -> bytes:
+    return ' '.join(text.splitlines()).encode() + b'\n'
@@ -0,0 +1,64 @@
+import time
+from typing import Optional
+
+from constants import (ACCEPT_RATE, MAX_CONNECTIONS, ROOM_BURST, ROOM_RATE,
+                       USER_BURST, USER_RATE)
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate: float = rate
+        self.capacity: float = capacity
+        self.tokens: float = capacity
+        self.updated: float = time.monotonic()
+
+    def consume(self, amount: float = 1) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+
+class Limiter:
+    def __init__(self, user_rate: float = USER_RATE,
+                 user_burst: float = USER_BURST,
+                 room_rate: float = ROOM_RATE,
+                 room_burst: float = ROOM_BURST,
+                 max_connections: int = MAX_CONNECTIONS,
+                 accept_rate: float = ACCEPT_RATE) -> None:
+        self.user_rate: float = user_rate
+        self.user_burst: float = max(user_burst, 1)
+        self.room_rate: float = room_rate
+        self.room_burst: float = max(room_burst, 1)
+        self.max_connections: int = max_connections
+        self.accept_bucket: Optional[TokenBucket] = None
+        if accept_rate:
+            self.accept_bucket = TokenBucket(accept_rate, accept_rate)
+        self.room_buckets: dict = {}
+
+    def user_bucket(self) -> Optional[TokenBucket]:
+        if not self.user_rate:
+            return None
+        return TokenBucket(self.user_rate, self.user_burst)
+
+    def allow_room(self, room: str) -> bool:
+        if not self.room_rate:
+            return True
+        bucket = self.room_buckets.get(room)
+        if bucket is None:
+            bucket = self.room_buckets[room] = TokenBucket(self.room_rate,
+                                                           self.room_burst)
+        return bucket.consume()
+
+    def admit(self, connections: int) -> Optional[str]:
+        if self.max_connections and connections >= self.max_connections:
+            return 'connections'
+        if self.accept_bucket is not None and not self.accept_bucket.consume():
+            return 'accept'
+        return None
@@ -0,0 +1,274 @@
+import mmap
+import os
+import struct
+import sys
+import time
+from bisect import bisect_right
+from itertools import islice
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+from constants import (HISTORY_CACHE_SIZE, HISTORY_INDEX_INTERVAL,
+                       HISTORY_MAX_AGE, HISTORY_SEGMENT_SIZE)
+from history import History, Message
+
+RECORD: struct.Struct = struct.Struct('<QdHI')
+INDEX_ENTRY: struct.Struct = struct.Struct('<QQd')
+
+
+class Segment:
+    def __init__(self, directory: Path, first_seq: int) -> None:
+        self.path: Path = directory / f'{first_seq:012d}.seg'
+        self.index_path: Path = self.path.with_suffix('.idx')
+        self.first_seq: int = first_seq
+        self.last_seq: int = first_seq - 1
+        self.last_time: float = 0.0
+        self.size: int = 0
+        self.records: int = 0
+        self.index_seqs: list = []
+        self.index_offsets: list = []
+        self.file: Optional[BinaryIO] = None
+        self.index_file: Optional[BinaryIO] = None
+        self.map: Optional[mmap.mmap] = None
+
+    def load(self) -> None:
+        self.size = self.path.stat().st_size
+        if self.index_path.exists():
+            data = self.index_path.read_bytes()
+            usable = len(data) - len(data) % INDEX_ENTRY.size
+            for seq, offset, send_time in INDEX_ENTRY.iter_unpack(
+                    data[:usable]):
+                if offset >= self.size:
+                    break
+                self.index_seqs.append(seq)
+                self.index_offsets.append(offset)
+        while True:
+            start = end = self.index_offsets[-1] if self.index_offsets else 0
+            records = 0
+            for end, message in self.scan(start):
+                self.last_seq, self.last_time = message.seq, message.time
+                records += 1
+            if records or not self.index_offsets:
+                break
+            self.index_seqs.pop()
+            self.index_offsets.pop()
+        self.records = max(len(self.index_offsets) - 1, 0) * (
+            HISTORY_INDEX_INTERVAL) + records
+        if end < self.size:
+            self.close()
+            with open(self.path, 'r+b') as file:
+                file.truncate(end)
+            self.size = end
+        with open(self.index_path, 'r+b' if self.index_path.exists()
+                  else 'wb') as file:
+            file.truncate(len(self.index_seqs) * INDEX_ENTRY.size)
+
+    def open(self) -> None:
+        self.file = open(self.path, 'ab')
+        self.index_file = open(self.index_path, 'ab')
+
+    def append(self, message: Message) -> None:
+        name = message.name.encode()
+        if self.records % HISTORY_INDEX_INTERVAL == 0:
+            self.index_seqs.append(message.seq)
+            self.index_offsets.append(self.size)
+            self.index_file.write(INDEX_ENTRY.pack(message.seq, self.size,
+                                                   message.time))
+        self.file.write(RECORD.pack(message.seq, message.time, len(name),
+                                    len(message.data)))
+        self.file.write(name)
+        self.file.write(message.data)
+        self.size += RECORD.size + len(name) + len(message.data)
+        self.records += 1
+        self.last_seq, self.last_time = message.seq, message.time
+
+    def view(self) -> Optional[mmap.mmap]:
+        if self.file is not None:
+            self.file.flush()
+        if self.map is not None and len(self.map) < self.size:
+            self.map.close()
+            self.map = None
+        if self.map is None and self.size:
+            with open(self.path, 'rb') as file:
+                self.map = mmap.mmap(file.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+        return self.map
+
+    def scan(self, offset: int) -> Iterator[tuple]:
+        view = self.view()
+        end = len(view) if view is not None else 0
+        while offset + RECORD.size <= end:
+            seq, send_time, name_size, data_size = RECORD.unpack_from(
+                view, offset)
+            start = offset + RECORD.size
+            stop = start + name_size + data_size
+            if stop > end:
+                return
+            name = sys.intern(str(view[start:start + name_size], 'utf-8'))
+            offset = stop
+            yield offset, Message(seq, send_time, name,
+                                  view[start + name_size:stop])
+
+    def read(self, after_seq: int) -> Iterator[Message]:
+        position = bisect_right(self.index_seqs, after_seq + 1) - 1
+        offset = self.index_offsets[position] if position >= 0 else 0
+        for _, message in self.scan(offset):
+            if message.seq > after_seq:
+                yield message
+
+    def cut(self, last_seq: int) -> None:
+        position = bisect_right(self.index_seqs, last_seq + 1) - 1
+        end = self.index_offsets[position] if position >= 0 else 0
+        for offset, message in self.scan(end):
+            if message.seq > last_seq:
+                break
+            end = offset
+        self.close()
+        with open(self.path, 'r+b') as file:
+            file.truncate(end)
+        self.index_seqs, self.index_offsets = [], []
+        self.last_seq, self.last_time = self.first_seq - 1, 0.0
+        self.load()
+
+    def flush(self) -> None:
+        if self.file is not None:
+            self.file.flush()
+            self.index_file.flush()
+
+    def dup(self) -> list:
+        if self.file is None:
+            return []
+        self.flush()
+        return [os.dup(self.file.fileno()), os.dup(self.index_file.fileno())]
+
+    def close(self) -> None:
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.index_file.close()
+            self.file = self.index_file = None
+
+    def remove(self) -> None:
+        self.close()
+        self.path.unlink(missing_ok=True)
+        self.index_path.unlink(missing_ok=True)
+
+
+class SegmentedHistory:
+    persistent: bool = True
+
+    def __init__(self, directory: Path, messages: Iterable = (),
+                 next_seq: int = 1, max_age: float = HISTORY_MAX_AGE,
+                 cache_size: int = HISTORY_CACHE_SIZE,
+                 segment_size: int = HISTORY_SEGMENT_SIZE) -> None:
+        self.directory: Path = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_age: float = max_age
+        self.segment_size: int = segment_size
+        self.segments: list = []
+        self.unsynced: list = []
+        self.dirty: bool = False
+        for path in sorted(self.directory.glob('*.seg')):
+            segment = Segment(self.directory, int(path.stem))
+            segment.load()
+            self.segments.append(segment)
+        if self.segments:
+            next_seq = max(next_seq, self.segments[-1].last_seq + 1)
+            self.segments[-1].open()
+        self.next_seq: int = next_seq
+        self.cache: History = History(
+            self.read(max(self.last_seq - cache_size, 0)), next_seq,
+            cache_size, max_age)
+        for message in messages:
+            self.append(message.data, message.time, message.name,
+                        message.seq)
+        self.trim()
+
+    def __len__(self) -> int:
+        return max(self.last_seq - self.first_seq + 1, 0)
+
+    def __iter__(self) -> Iterator[Message]:
+        return self.read(self.first_seq - 1)
+
+    @property
+    def first_seq(self) -> int:
+        for segment in self.segments:
+            if segment.last_seq >= segment.first_seq:
+                return segment.first_seq
+        return self.next_seq
+
+    @property
+    def last_seq(self) -> int:
+        return self.next_seq - 1
+
+    def append(self, data: bytes, send_time: float, name: str,
+               seq: Optional[int] = None) -> Message:
+        if seq is not None and seq < self.next_seq:
+            return Message(seq, send_time, sys.intern(name), data)
+        message = self.cache.append(data, send_time, name, seq)
+        self.next_seq = message.seq + 1
+        self.dirty = True
+        if not self.segments or self.segments[-1].size >= self.segment_size:
+            if self.segments:
+                self.unsynced.extend(self.segments[-1].dup())
+                self.segments[-1].close()
+            segment = Segment(self.directory, message.seq)
+            segment.open()
+            self.segments.append(segment)
+        self.segments[-1].append(message)
+        self.trim(send_time)
+        return message
+
+    def trim(self, now: Optional[float] = None) -> None:
+        deadline = (time.time() if now is None else now) - self.max_age
+        while len(self.segments) > 1 and (
+                self.segments[0].last_time <= deadline):
+            self.segments.pop(0).remove()
+        self.cache.trim(now)
+
+    def read(self, after_seq: int) -> Iterator[Message]:
+        deadline = time.time() - self.max_age
+        position = bisect_right([segment.first_seq for segment in
+                                 self.segments], after_seq + 1) - 1
+        for segment in self.segments[max(position, 0):]:
+            for message in segment.read(after_seq):
+                if message.time > deadline:
+                    yield message
+
+    def tail(self, count: int) -> list:
+        if count <= len(self.cache) or self.cache.first_seq <= self.first_seq:
+            return self.cache.tail(count)
+        return self.since(self.last_seq - count)
+
+    def since(self, seq: int, limit: Optional[int] = None) -> list:
+        self.trim()
+        if seq + 1 >= self.cache.first_seq:
+            return self.cache.since(seq, limit)
+        return list(islice(self.read(seq), limit))
+
+    def rewind(self, next_seq: int) -> None:
+        while self.segments and self.segments[-1].first_seq >= next_seq:
+            self.segments.pop().remove()
+        if self.segments and self.segments[-1].last_seq >= next_seq:
+            self.segments[-1].cut(next_seq - 1)
+        if self.segments and self.segments[-1].file is None:
+            self.segments[-1].open()
+        self.next_seq = next_seq
+        self.cache.rewind(next_seq)
+
+    def flush(self) -> None:
+        if self.segments:
+            self.segments[-1].flush()
+
+    def checkpoint(self) -> list:
+        fds, self.unsynced = self.unsynced, []
+        if self.dirty and self.segments:
+            fds.extend(self.segments[-1].dup())
+        self.dirty = False
+        return fds
+
+    def close(self) -> None:
+        for segment in self.segments:
+            segment.close()
@@ -0,0 +1,33 @@
+import time
+from typing import Optional, Union
+
+from outbox import Outbox
+from protocol import FrameDecoder
+from ratelimit import TokenBucket
+
+
+class Session:
+    __slots__ = ('address', 'outbox', 'username', 'rooms', 'last_activity',
+                 'bucket', 'throttled', 'decoder', 'reliable', 'ack_due',
+                 'last_id', 'frame_id')
+
+    def __init__(self, address: tuple, outbox: Outbox,
+                 bucket: Optional[TokenBucket] = None) -> None:
+        self.address: tuple = address
+        self.outbox: Outbox = outbox
+        self.username: Optional[str] = None
+        self.rooms: set = set()
+        self.last_activity: float = time.monotonic()
+        self.bucket: Optional[TokenBucket] = bucket
+        self.throttled: set = set()
+        self.decoder: FrameDecoder = FrameDecoder()
+        self.reliable: bool = False
+        self.ack_due: bool = False
+        self.last_id: int = 0
+        self.frame_id: int = 0
+
+    def touch(self) -> None:
+        self.last_activity = time.monotonic()
+
+    def send(self, data: Union[bytes, list]) -> bool:
+        return self.outbox.put(data)
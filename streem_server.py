@@ -1,311 +1,1131 @@
 import asyncio
-import json
 import os
+import shutil
+import signal
+import socket
+import tempfile
 import time
+import traceback
 from asyncio import StreamReader, StreamWriter
-from typing import Optional
+from pathlib import Path
+from typing import Iterable, Optional, Union
 
 from aiologger import Logger
 
+from bus import Bus, Hub
+from cluster import Cluster
 from config import configure_server_logging, server_arg_parser
-from constants import HOST, PORT
+from constants import (COMPRESSION, GENERAL_ROOM, HANDOFF_TIMEOUT,
+                       HEARTBEAT_INTERVAL, HISTORY_MAX_AGE, HISTORY_MAX_SIZE,
+                       HISTORY_PAGE_SIZE, HOST, IDLE_TIMEOUT,
+                       JOURNAL_FLUSH_INTERVAL, LAST_MESSAGES_COUNT, LOG_BACKUPS, LOG_MAX_BYTES,
+                       METRICS_HOST, METRICS_PORT, OUTBOUND_BUFFER_SIZE, PORT,
+                       READ_BUFFER_SIZE, RELIABLE,
+                       SLOW_CONSUMER_POLICY, SLOW_CONSUMER_TIMEOUT,
+                       STATE_DIR, WRITE_BUFFER_HIGH, WRITE_BUFFER_LOW)
+from handoff import WITH_SESSIONS, send_handoff, take_over
+from history import History, Message
+from journal import Journal, read_journal, sync_files
+from metrics import Metrics, gauge
+from outbox import Outbox
+from ratelimit import Limiter
+from segments import SegmentedHistory
+from session import Session
 from utils import generate_unique_code
 
 
 class Server:
-    def __init__(self, logger: Logger) -> None:
-        self.connections: dict = {}
+    def __init__(self, logger: Logger,
+                 history_size: int = HISTORY_MAX_SIZE,
+                 history_age: float = HISTORY_MAX_AGE,
+                 journal: Optional[Journal] = None,
+                 worker_id: int = 0,
+                 limiter: Optional[Limiter] = None,
+                 outbox_options: Optional[dict] = None,
+                 history_dir: Optional[Path] = None) -> None:
+        self.sessions: dict = {}
         self.logger: Logger = logger
-        self.message_list: list = []
+        self.journal: Optional[Journal] = journal
+        self.worker_id: int = worker_id
+        self.node: Union[int, str] = worker_id
+        self.bus: Optional[Bus] = None
+        self.cluster: Optional[Cluster] = None
+        self.handoff: Optional[socket.socket] = None
+        self.metrics: Metrics = Metrics(logger)
+        self.metrics.add_collector(self.collect_metrics)
+        self.limiter: Limiter = limiter or Limiter()
+        self.outbox_options: dict = outbox_options or {}
+        self.history_size: int = history_size
+        self.history_age: float = history_age
+        self.history_dir: Optional[Path] = history_dir
+        self.message_list: History = self.new_history(GENERAL_ROOM)
         self.channels: dict = {}
+        self.general: set = set()
         self.channels_message: dict = {}
         self.access_codes: dict = {}
-        self.usernames: dict = {}
-        self.addresses: dict = {}
-        if os.path.exists('server_state.json'):
-            self.load_state_from_file()
+        self.users: dict = {}
+        self.cursors: dict = {}
+        self.directory: dict = {}
+        self.subscribers: dict = {}
+        self.client_ids: dict = {}
+        self.handlers: dict = {
+            'message': self.apply_message,
+            'create': self.apply_create,
+            'invite': self.apply_invite,
+            'leave': self.apply_leave,
+            'private': self.apply_private,
+            'login': self.apply_login,
+            'logout': self.apply_logout,
+            'join': self.apply_join,
+            'history': self.apply_history,
+            'replay': self.apply_replay,
+            'deliver': self.apply_deliver,
+            'joined': self.apply_joined,
+            'reply': self.apply_reply,
+            'subscribe': self.apply_subscribe,
+            'unsubscribe': self.apply_subscribe,
+            'received': self.apply_received,
+            'resume': self.apply_resume,
+            'resumed': self.apply_resumed,
+        }
 
     async def handle_client(self, reader: StreamReader,
                             writer: StreamWriter) -> None:
         address = writer.get_extra_info('peername')
-        self.connections[address] = writer
-        await self.logger.info(f'Start serving {address}')
+        rejected = self.limiter.admit(len(self.sessions))
+        if rejected is not None:
+            self.metrics.rate_limited.inc(scope=rejected)
+            self.logger.info('Connection %(address)s rejected: %(reason)s',
+                             {'address': address, 'reason': rejected},
+                             extra={'event': 'reject'})
+            writer.write(b'Server is busy, try again later\n')
+            writer.close()
+            return
+        session = self.open_session(address, writer)
+        self.logger.info('Start serving %(address)s', {'address': address},
+                         extra={'event': 'connect'})
+        await self.serve_session(session, reader)
 
-        while True:
-            data = await reader.read(1000)
-            my_address = writer.get_extra_info('peername')
+    def open_session(self, address: tuple, writer: StreamWriter) -> Session:
+        session = Session(address, Outbox(writer, self.logger,
+                                          metrics=self.metrics,
+                                          **self.outbox_options),
+                          self.limiter.user_bucket())
+        self.sessions[address] = session
+        self.general.add(session)
+        self.subscribe(GENERAL_ROOM)
+        return session
 
+    async def serve_session(self, session: Session,
+                            reader: StreamReader) -> None:
+        serving = True
+        while serving:
+            try:
+                data = await reader.read(READ_BUFFER_SIZE)
+            except ConnectionError:
+                data = b''
             if not data:
-                await self.logger.info(f'Connection {address} lost')
-                if my_address in self.connections:
-                    del self.connections[my_address]
-                writer.close()
+                if session.address in self.sessions:
+                    self.logger.info('Connection %(address)s lost',
+                                     {'address': session.address},
+                                     extra={'event': 'connect'})
+                    self.close_session(session)
                 break
+            session.touch()
+            for frame in session.decoder.feed(data):
+                self.metrics.messages_in.inc()
+                serving = await self.handle_frame(session, frame)
+                if session.frame_id:
+                    session.last_id, session.frame_id = session.frame_id, 0
+                if not serving:
+                    break
+            if session.ack_due:
+                self.flush_ack(session)
 
-            try:
-                message = data.decode('UTF-8')
-            except UnicodeDecodeError:
-                my_address = writer.get_extra_info('peername')
-                await self.logger.info('Unacceptable type of message.')
-                self.connections[my_address].write(
-                    b'This message has unacceptable type!\n')
-                await self.connections[my_address].drain()
-                continue
+    async def decode_frame(self, session: Session,
+                           frame: Optional[memoryview]) -> Optional[str]:
+        if frame is None:
+            session.send(b'This message is too long!\n')
+            return None
+        try:
+            message = str(frame, 'UTF-8').strip()
+        except UnicodeDecodeError:
+            await self.logger.info('Unacceptable type of message.')
+            session.send(b'This message has unacceptable type!\n')
+            return None
+        if session.reliable and message.startswith('#'):
+            return self.number(session, message)
+        return message
 
-            if message.strip() == '':
-                continue
+    def number(self, session: Session, message: str) -> Optional[str]:
+        head, _, body = message[1:].partition(' ')
+        if not head.isdigit():
+            return message
+        message_id = int(head)
+        session.ack_due = True
+        if message_id != session.last_id + 1:
+            return None
+        session.frame_id = message_id
+        return body
 
-            if my_address not in self.usernames:
-                if self.message_list and message.strip() not in self.usernames.values():
-                    last_messages = ''.join(
-                        message[0] for message in self.message_list[-20:])
-                    writer.write(last_messages.encode())
-                    await writer.drain()
-
-                if self.message_list and message.strip() in self.usernames.values():
-                    last_messages_rev = []
-                    for message_text in self.message_list[::-1]:
-                        if message_text[2] == message.strip():
-                            break
-                        last_messages_rev.append(message_text[0])
-                    last_messages = ''.join(list(reversed(last_messages_rev)))
-                    writer.write(last_messages.encode())
-                    await writer.drain()
-                self.usernames[my_address] = message.strip()
-                self.addresses[message.strip()] = my_address
-                continue
+    def flush_ack(self, session: Session) -> None:
+        session.ack_due = False
+        self.commit({'op': 'received', 'user': session.username,
+                     'id': session.last_id})
+        session.send(b'ACK %d\n' % session.last_id)
 
-            channel_name = message.split()[0]
-            if 'quit' in message.strip():
-                await self.logger.info(
-                    f'Connection {my_address} closed by client')
-                if my_address in self.connections:
-                    del self.connections[my_address]
-                writer.write(b'SERVER_SHUTDOWN\n')
-                await writer.drain()
-                writer.close()
-                break
+    async def handle_frame(self, session: Session,
+                           frame: Optional[memoryview]) -> bool:
+        message = await self.decode_frame(session, frame)
+        if not message:
+            return True
+
+        if session.username is None:
+            self.login(session, message)
+            return True
+
+        channel_name = None
+        head, _, body = message.partition(' ')
+        if head in self.channels:
+            channel_name, message = head, body.lstrip()
+
+        if message == 'quit':
+            self.logger.info('Connection %(address)s closed by client',
+                             {'address': session.address},
+                             extra={'event': 'connect'})
+            self.close_session(session, b'SERVER_SHUTDOWN\n')
+            return False
+        elif not self.admit_message(session, message):
+            return True
+        elif message.startswith('/'):
+            await self.command_received(message[1:], session, channel_name)
+        elif message:
+            self.broadcast(channel_name or GENERAL_ROOM, session, message)
+        return True
+
+    def admit_message(self, session: Session, message: str) -> bool:
+        if message.startswith('/ack '):
+            return True
+        if session.bucket is not None and not session.bucket.consume():
+            self.throttle(session, 'user')
+            return False
+        session.throttled.discard('user')
+        return True
+
+    def throttle(self, session: Session, scope: str) -> None:
+        self.metrics.rate_limited.inc(scope=scope)
+        session.frame_id = 0
+        if scope not in session.throttled:
+            session.throttled.add(scope)
+            session.send(b'Too many messages, slow down\n')
+
+    def broadcast(self, room: str, session: Session, message: str) -> None:
+        if not self.limiter.allow_room(room):
+            self.throttle(session, 'room')
+            return
+        session.throttled.discard('room')
+        name = session.username
+        self.commit({'op': 'message', 'room': room, 'time': time.time(),
+                     'name': name, 'text': f'{name}: {message}\n',
+                     'worker': self.node, 'address': session.address})
+
+    def login(self, session: Session, handshake: str) -> None:
+        username, *capabilities = handshake.split(' +')
+        session.username = username
+        self.users[username] = session
+        self.commit({'op': 'login', 'user': username, 'worker': self.node})
+        compress = COMPRESSION in capabilities
+        if RELIABLE not in capabilities:
+            self.greet(session, compress)
+            return
+        session.reliable = True
+        self.request({'op': 'resume', 'user': username, 'compress': compress,
+                      'worker': self.node, 'address': session.address})
+
+    def greet(self, session: Session, compress: bool) -> None:
+        if compress:
+            session.send(f'CAPS {COMPRESSION}\n'.encode())
+            session.outbox.start_compression()
+        self.replay(session, session.username, GENERAL_ROOM)
+
+    def close_session(self, session: Session,
+                      farewell: Optional[bytes] = None) -> None:
+        if self.sessions.pop(session.address, None) is None:
+            return
+        if farewell is not None:
+            session.send(farewell)
+        session.outbox.close()
+        for channel_name in session.rooms:
+            self.channels[channel_name].discard(session)
+            self.mark_read(session, channel_name)
+            self.unsubscribe(channel_name)
+        session.rooms.clear()
+        if session in self.general:
+            self.general.remove(session)
+            self.mark_read(session, GENERAL_ROOM)
+            self.unsubscribe(GENERAL_ROOM)
+        if self.users.get(session.username) is session:
+            del self.users[session.username]
+            self.commit({'op': 'logout', 'user': session.username,
+                         'worker': self.node})
+
+    async def reap_idle(self, interval: float = HEARTBEAT_INTERVAL,
+                        timeout: float = IDLE_TIMEOUT) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for session in list(self.sessions.values()):
+                idle = now - session.last_activity
+                if idle >= timeout:
+                    self.logger.info('Connection %(address)s idle, closing',
+                                     {'address': session.address},
+                                     extra={'event': 'idle'})
+                    self.close_session(
+                        session, b'Connection closed due to inactivity\n')
+                elif idle >= interval:
+                    session.send(b'PING\n')
+
+    def new_history(self, room: str, messages: Iterable = (),
+                    next_seq: int = 1) -> History:
+        if self.history_dir is None:
+            return History(messages, next_seq, self.history_size,
+                           self.history_age)
+        return SegmentedHistory(self.history_dir / room.encode().hex(),
+                                messages, next_seq, self.history_age)
+
+    def histories(self) -> dict:
+        return {GENERAL_ROOM: self.message_list, **self.channels_message}
+
+    def checkpoint(self) -> list:
+        fds = []
+        for history in self.histories().values():
+            if history.persistent:
+                fds.extend(history.checkpoint())
+        return fds
+
+    async def sync_histories(self,
+                             interval: float = JOURNAL_FLUSH_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            fds = self.checkpoint()
+            if fds:
+                await asyncio.to_thread(sync_files, fds)
+
+    def start_persistence(self) -> list:
+        if self.journal is not None:
+            return [asyncio.create_task(
+                self.journal.run(self.snapshot_state, self.checkpoint))]
+        if self.history_dir is not None:
+            return [asyncio.create_task(self.sync_histories())]
+        return []
+
+    def close_histories(self) -> None:
+        sync_files(self.checkpoint())
+        for history in self.histories().values():
+            if history.persistent:
+                history.close()
+
+    def room_members(self, room: str) -> set:
+        if room == GENERAL_ROOM:
+            return self.general
+        return self.channels[room]
+
+    def room_history(self, room: str) -> History:
+        if room == GENERAL_ROOM:
+            return self.message_list
+        return self.channels_message[room]
+
+    def open_channel(self, channel_name: str, owner: str) -> None:
+        self.channels[channel_name] = set()
+        self.channels_message[channel_name] = self.new_history(channel_name)
+        self.channels_message[channel_name].rewind(1)
+        self.access_codes[channel_name] = {owner: 'my'}
 
-            elif message.startswith('/'):
-                await self.command_received(message[1:], my_address)
-
-            elif channel_name in self.channels.keys():
-                channel_name, message_text = message.split(' ', 1)
-
-                if message_text.startswith('/'):
-                    message = message.split(' ', 1)[1].strip()
-                    await self.command_received(message[1:], my_address,
-                                                channel_name)
-                    continue
-
-                send_text = f'{self.usernames[my_address]}: {message_text}'
-                send_time = time.time()
-                name = self.usernames[my_address]
-                self.channels_message[channel_name].append(
-                    (send_text, send_time, name,))
-                for address in self.channels[channel_name]:
-                    if address != my_address:
-                        self.connections[address].write(send_text.encode())
-                        await self.connections[address].drain()
-
-            elif channel_name not in self.channels.keys():
-                name = self.usernames[my_address]
-                send_text = f"{name}: {message}"
-                for client_address, client_writer in self.connections.items():
-                    if not any(
-                            client_address in address_list for address_list in
-                            self.channels.values()):
-                        if client_address != my_address:
-                            client_writer.write(send_text.encode())
-                            await client_writer.drain()
-                send_time = time.time()
-                self.message_list.append((send_text, send_time, name,))
-
-    async def join(self, writer: StreamWriter, command: str,
-                   address: str) -> None:
+    def mark_read(self, session: Session, room: str) -> None:
+        if session.username is None or session.reliable:
+            return
+        record = {'op': 'leave', 'room': room, 'user': session.username}
+        if self.cluster is None:
+            record['seq'] = self.room_history(room).last_seq
+        self.commit(record)
+
+    def unread(self, username: str, room: str,
+               reliable: bool = False) -> list:
+        history = self.room_history(room)
+        cursor = self.cursors.get(username, {}).get(room)
+        if cursor is None:
+            messages = history.tail(LAST_MESSAGES_COUNT)
+        else:
+            messages = history.since(cursor)
+        if not reliable:
+            return [message.data for message in messages]
+        prefix = room.encode()
+        data = []
+        for message in messages:
+            data.append(b'@%s %d ' % (prefix, message.seq))
+            data.append(message.data)
+        return data
+
+    def replay(self, session: Session, username: str, room: str) -> None:
+        self.request({'op': 'replay', 'room': room, 'user': username,
+                      'reliable': session.reliable,
+                      'worker': self.node, 'address': session.address})
+
+    def add_member(self, channel_name: str, session: Session) -> None:
+        self.channels[channel_name].add(session)
+        self.subscribe(channel_name)
+        session.rooms.add(channel_name)
+        if session in self.general:
+            self.general.remove(session)
+            self.mark_read(session, GENERAL_ROOM)
+            self.unsubscribe(GENERAL_ROOM)
+
+    def remove_member(self, channel_name: str, session: Session) -> None:
+        self.channels[channel_name].discard(session)
+        self.mark_read(session, channel_name)
+        self.unsubscribe(channel_name)
+        session.rooms.discard(channel_name)
+        if session.address in self.sessions and not session.rooms:
+            self.general.add(session)
+            self.subscribe(GENERAL_ROOM)
+
+    def subscribe(self, room: str) -> None:
+        if self.cluster is not None and len(self.room_members(room)) == 1:
+            self.cluster.route({'op': 'subscribe', 'room': room,
+                                'worker': self.node})
+
+    def unsubscribe(self, room: str) -> None:
+        if self.cluster is not None and not self.room_members(room):
+            self.cluster.route({'op': 'unsubscribe', 'room': room,
+                                'worker': self.node})
+
+    async def join(self, session: Session, command: str) -> None:
         channel_name = command.split(' ')[1].strip()
         try:
             access_code = command.split(' ')[2].strip()
         except IndexError:
-            writer.write(b'Provide a group access code\n')
-            await writer.drain()
-        username = self.usernames[address]
-        if username not in self.access_codes[channel_name]:
-            writer.write(b'Nobody invited you to this group!\n')
-            await writer.drain()
-        elif channel_name in self.channels and username in self.access_codes[channel_name]:
-            self.channels[channel_name].append(address)
-
-            if self.access_codes[channel_name][username] == access_code:
-                if self.channels_message[channel_name]:
-                    last_messages_rev = []
-                    for message_text in reversed(
-                            self.channels_message[channel_name]):
-                        if message_text[2] == self.usernames[address]:
-                            break
-                        last_messages_rev.append(message_text[0])
-                    last_messages = f'Вы подключились к чату {channel_name}\n' + ''.join(
-                        list(reversed(last_messages_rev)))
-                    writer.write(last_messages.encode())
-
-                elif not self.channels_message[channel_name]:
-                    last_messages = f'Вы подключились к чату {channel_name}\n'
-                    writer.write(last_messages.encode())
-                await writer.drain()
-            elif self.access_codes[channel_name][username] != access_code:
-                writer.write(b'Non-existent access code\n')
-                await writer.drain()
-        else:
-            writer.write(b'Channel does not exist\n')
-            await writer.drain()
+            session.send(b'Provide a group access code\n')
+            return
+        self.request({'op': 'join', 'room': channel_name,
+                      'user': session.username, 'code': access_code,
+                      'reliable': session.reliable,
+                      'worker': self.node, 'address': session.address})
 
-    async def leave(self, writer: StreamWriter, command: str,
-                    address: str) -> None:
+    async def leave(self, session: Session, command: str) -> None:
         channel_name = command.split(' ', 1)[1].strip()
-        if channel_name in self.channels and address in self.channels[channel_name]:
-            self.channels[channel_name].remove(address)
-            last_messages_rev = []
-            name = self.usernames[address]
-            for message_text in self.message_list[::-1]:
-                if message_text[2] == name:
-                    break
-                last_messages_rev.append(message_text[0])
-            last_messages = f'Вы отключились от чата {channel_name}\n' + ''.join(
-                list(reversed(last_messages_rev)))
-            writer.write(last_messages.encode())
-            await writer.drain()
+        if channel_name in session.rooms:
+            self.remove_member(channel_name, session)
+            session.send(f'Вы отключились от чата {channel_name}\n'.encode())
+            if session in self.general:
+                self.replay(session, session.username, GENERAL_ROOM)
         else:
-            writer.write(b'You are not in this channel\n')
-            await writer.drain()
+            session.send(b'You are not in this channel\n')
 
-    async def create(self, writer: StreamWriter, command: str,
-                     address: str) -> None:
+    async def create(self, session: Session, command: str) -> None:
         channel_name = command.split(' ', 1)[1].strip()
-        if channel_name not in self.channels:
-            self.channels[channel_name] = [address]
-            self.channels_message[channel_name] = []
-            self.access_codes[channel_name] = {self.usernames[address]: 'my'}
-            writer.write(
-                f'Вы подключились к чату {channel_name}\n'.encode())
-            await writer.drain()
+        if channel_name not in self.channels and channel_name != GENERAL_ROOM:
+            self.commit({'op': 'create', 'room': channel_name,
+                         'owner': session.username,
+                         'worker': self.node,
+                         'address': session.address})
         else:
-            writer.write(b'Channel already exists\n')
-            await writer.drain()
-
-    async def private(self, writer: StreamWriter, command: str,
-                      address: str) -> None:
-        recipient, message = command.split(' ', 2)[1:]
-        if recipient.strip() in self.addresses:
-            message_text = f'{self.usernames[address]}: (private) {message}'
-            self.connections[self.addresses[recipient]].write(
-                message_text.encode())
-            await self.connections[self.addresses[recipient]].drain()
+            session.send(b'Channel already exists\n')
+
+    async def private(self, session: Session, command: str) -> None:
+        try:
+            recipient, message = command.split(' ', 2)[1:]
+        except ValueError:
+            session.send(b'Usage: /private <username> <message>\n')
+            return
+        if self.cluster is not None or recipient in self.directory:
+            self.commit({'op': 'private', 'user': recipient,
+                         'text': f'{session.username}: (private) {message}\n',
+                         'worker': self.node, 'address': session.address})
         else:
-            writer.write(b'There is no user with such name.\n')
-            await writer.drain()
+            session.send(b'There is no user with such name.\n')
 
-    async def invite(self, writer: StreamWriter, command: str,
+    async def invite(self, session: Session, command: str,
                      channel_name: str) -> None:
         username = command.split(' ', 1)[1].strip()
-        if username in self.addresses:
-            user_address = self.addresses[username]
-            access_code = generate_unique_code()
-            self.access_codes[channel_name][username] = access_code
-            message = f'Вы приглашены в группу ({channel_name})\n'
-            end_of_message = f'Для вступления введите команду "/join {channel_name} {access_code}"\n'
-            send_text = message + end_of_message
-            self.connections[user_address].write(send_text.encode())
-            await self.connections[user_address].drain()
+        if channel_name not in self.channels:
+            session.send(b'You are not in this channel\n')
+        elif self.cluster is not None or username in self.directory:
+            self.commit({'op': 'invite', 'room': channel_name,
+                         'user': username, 'code': generate_unique_code(),
+                         'worker': self.node, 'address': session.address})
         else:
-            writer.write(b'There is no user with such name.\n')
-            await writer.drain()
+            session.send(b'There is no user with such name.\n')
+
+    async def history(self, session: Session, command: str) -> None:
+        try:
+            room, since_seq, limit = command.split()[1:]
+            since_seq, limit = int(since_seq), int(limit)
+        except ValueError:
+            session.send(b'Usage: /history <room> <since_seq> <limit>\n')
+            return
+        if room != GENERAL_ROOM and room not in session.rooms:
+            session.send(b'You are not in this channel\n')
+            return
+        self.request({'op': 'history', 'room': room, 'since': since_seq,
+                      'limit': min(limit, HISTORY_PAGE_SIZE),
+                      'worker': self.node, 'address': session.address})
+
+    def ack(self, session: Session, command: str) -> None:
+        fields = command.split()[1:]
+        for room, seq in zip(fields[::2], fields[1::2]):
+            if not seq.isdigit() or (room != GENERAL_ROOM
+                                     and room not in session.rooms):
+                continue
+            self.commit({'op': 'leave', 'room': room,
+                         'user': session.username, 'seq': int(seq)})
 
     async def command_received(self,
                                command: str,
-                               address: str,
+                               session: Session,
                                channel_name: Optional[str] = None) -> None:
-        writer = self.connections[address]
+        started = time.perf_counter()
         if command.startswith('join '):
-            await self.join(writer, command, address)
+            await self.join(session, command)
         elif command.startswith('leave '):
-            await self.leave(writer, command, address)
+            await self.leave(session, command)
         elif command.startswith('create '):
-            await self.create(writer, command, address)
+            await self.create(session, command)
         elif command.startswith('private '):
-            await self.private(writer, command, address)
+            await self.private(session, command)
         elif command.startswith('invite '):
-            await self.invite(writer, command, channel_name)
+            await self.invite(session, command, channel_name)
+        elif command.startswith('history '):
+            await self.history(session, command)
+        elif command.startswith('ack '):
+            self.ack(session, command)
+        elif command == 'ping':
+            session.send(b'PONG\n')
+        else:
+            return
+        self.metrics.command_latency.observe(
+            time.perf_counter() - started, command=command.split(' ', 1)[0])
 
-    async def remove_old_messages(self) -> None:
-        while True:
-            await self.logger.info('Checking the messages time.')
-            current_time = time.time()
-            self.message_list = [(msg, timestamp, _) for (msg, timestamp, _) in
-                                 self.message_list if
-                                 current_time - timestamp < 60 * 60]
-            if self.channels_message:
-                for channel, channel_msg in self.channels_message.items():
-                    current_time = time.time()
-                    self.channels_message[channel] = [(msg, timestamp, _) for
-                                                      (msg, timestamp, _) in
-                                                      channel_msg if
-                                                      current_time - timestamp < 60 * 60]
-            await asyncio.sleep(60)
-
-    async def save_state_to_file(self):
-        data_to_save = {
-            'message_list': self.message_list,
-            'channels': {str(channel): [] for channel in self.channels.keys()},
-            'channels_message': {str(channel): messages for channel, messages
-                                 in self.channels_message.items()},
-            'usernames': {str(address): username for address, username in
-                          self.usernames.items()},
-            'access_codes': self.access_codes,
+    def collect_metrics(self) -> list:
+        rooms = self.histories()
+        outboxes = [session.outbox for session in self.sessions.values()]
+        return [
+            *gauge('streem_connections', 'Open client connections.',
+                   {(): len(self.sessions)}),
+            *gauge('streem_room_members', 'Connected members per room.',
+                   {(('room', room),): len(self.room_members(room))
+                    for room in rooms}),
+            *gauge('streem_history_messages', 'Messages kept per room.',
+                   {(('room', room),): len(history)
+                    for room, history in rooms.items()}),
+            *gauge('streem_outbound_queued_messages',
+                   'Messages waiting in outbound queues.',
+                   {(): sum(outbox.queue.qsize() for outbox in outboxes)}),
+            *gauge('streem_outbound_queued_bytes',
+                   'Bytes waiting in outbound queues.',
+                   {(): sum(outbox.queued_bytes for outbox in outboxes)}),
+            *gauge('streem_outbound_buffer_bytes',
+                   'Bytes buffered in client transports.',
+                   {(): sum(outbox.writer.transport.get_write_buffer_size()
+                            for outbox in outboxes)}),
+        ]
+
+    def log(self, record: dict) -> None:
+        if self.journal is not None:
+            self.journal.append(record)
+
+    def commit(self, record: dict) -> None:
+        if self.cluster is not None:
+            self.cluster.route(record)
+        elif self.bus is None:
+            self.apply(record)
+        else:
+            self.bus.publish(record)
+
+    def request(self, record: dict) -> None:
+        if self.cluster is not None:
+            self.cluster.route(record)
+        else:
+            self.apply(record)
+
+    def origin(self, record: dict) -> Optional[Session]:
+        if record.get('worker') == self.node and 'address' in record:
+            return self.sessions.get(tuple(record['address']))
+        return None
+
+    def reply(self, record: dict, data: Union[bytes, list]) -> None:
+        session = self.origin(record)
+        if session is not None:
+            session.send(data)
+        elif self.cluster is not None and 'address' in record:
+            if isinstance(data, list):
+                data = b''.join(data)
+            self.cluster.send(record['worker'], {
+                'op': 'reply', 'worker': record['worker'],
+                'address': record['address'], 'text': data.decode()})
+
+    def accept(self, record: dict, data: list) -> None:
+        room, session = record['room'], self.origin(record)
+        if session is not None:
+            self.add_member(room, session)
+            session.send(data)
+        elif self.cluster is not None and 'address' in record:
+            self.subscribers.setdefault(room, set()).add(record['worker'])
+            self.cluster.send(record['worker'], {
+                'op': 'joined', 'room': room, 'worker': record['worker'],
+                'address': record['address'],
+                'text': b''.join(data).decode()})
+
+    def apply(self, record: dict) -> None:
+        self.handlers[record['op']](record)
+
+    def apply_message(self, record: dict) -> None:
+        room, text = record['room'], record['text']
+        message = self.room_history(room).append(
+            text.encode(), record['time'], record['name'], record.get('seq'))
+        self.log({'op': 'message', 'room': room, 'seq': message.seq,
+                  'time': record['time'], 'name': record['name'],
+                  'text': text})
+        self.fan_out(self.room_members(room), room, message.seq,
+                     message.data, self.origin(record))
+        if self.cluster is not None:
+            for node in self.subscribers.get(room, ()):
+                if node != self.node:
+                    self.cluster.send(node, {
+                        'op': 'deliver', 'room': room, 'seq': message.seq,
+                        'text': text, 'worker': record.get('worker'),
+                        'address': record.get('address')})
+
+    @staticmethod
+    def fan_out(members: Iterable, room: str, seq: int, data: bytes,
+                sender: Optional[Session]) -> None:
+        numbered = b'@%s %d ' % (room.encode(), seq)
+        for member in members:
+            if not member.reliable:
+                if member is not sender:
+                    member.send(data)
+            elif member is sender:
+                member.send(numbered[:-1] + b'\n')
+            else:
+                member.send([numbered, data])
+
+    def apply_deliver(self, record: dict) -> None:
+        data = record['text'].encode()
+        if 'user' in record:
+            session = self.users.get(record['user'])
+            if session is not None:
+                session.send(data)
+            return
+        room = record['room']
+        members = (self.general if room == GENERAL_ROOM
+                   else self.channels.get(room, ()))
+        self.fan_out(members, room, record['seq'], data, self.origin(record))
+
+    def apply_create(self, record: dict) -> None:
+        channel_name = record['room']
+        if channel_name in self.channels:
+            self.reply(record, b'Channel already exists\n')
+            return
+        self.open_channel(channel_name, record['owner'])
+        self.log({'op': 'create', 'room': channel_name,
+                  'owner': record['owner']})
+        self.accept(record,
+                    [f'Вы подключились к чату {channel_name}\n'.encode()])
+
+    def apply_join(self, record: dict) -> None:
+        channel_name, username = record['room'], record['user']
+        codes = self.access_codes.get(channel_name)
+        if codes is None:
+            self.reply(record, b'Channel does not exist\n')
+        elif username not in codes:
+            self.reply(record, b'Nobody invited you to this group!\n')
+        elif codes[username] != record['code']:
+            self.reply(record, b'Non-existent access code\n')
+        else:
+            self.accept(record,
+                        [f'Вы подключились к чату {channel_name}\n'.encode(),
+                         *self.unread(username, channel_name,
+                                      record.get('reliable', False))])
+
+    def apply_joined(self, record: dict) -> None:
+        room, session = record['room'], self.origin(record)
+        self.channels.setdefault(room, set())
+        if session is None:
+            self.unsubscribe(room)
+            return
+        self.add_member(room, session)
+        session.send(record['text'].encode())
+
+    def apply_invite(self, record: dict) -> None:
+        channel_name, username = record['room'], record['user']
+        codes = self.access_codes.get(channel_name)
+        if codes is None:
+            self.reply(record, b'You are not in this channel\n')
+            return
+        access_code = record['code']
+        codes[username] = access_code
+        self.log({'op': 'invite', 'room': channel_name, 'user': username,
+                  'code': access_code})
+        message = f'Вы приглашены в группу ({channel_name})\n'
+        end_of_message = f'Для вступления введите команду "/join {channel_name} {access_code}"\n'
+        send_text = message + end_of_message
+        if self.cluster is not None:
+            self.commit({'op': 'private', 'user': username,
+                         'text': send_text, 'worker': record.get('worker'),
+                         'address': record.get('address')})
+            return
+        session = self.users.get(username)
+        if session is not None:
+            session.send(send_text.encode())
+
+    def apply_leave(self, record: dict) -> None:
+        room = record['room']
+        if 'seq' not in record:
+            record = {**record, 'seq': self.room_history(room).last_seq}
+        self.cursors.setdefault(record['user'], {})[room] = record['seq']
+        self.log(record)
+
+    def apply_private(self, record: dict) -> None:
+        username = record['user']
+        if self.cluster is None:
+            session = self.users.get(username)
+            if session is not None:
+                session.send(record['text'].encode())
+        elif username in self.directory:
+            self.cluster.send(self.directory[username], {
+                'op': 'deliver', 'user': username, 'text': record['text']})
+        else:
+            self.reply(record, b'There is no user with such name.\n')
+
+    def apply_login(self, record: dict) -> None:
+        self.directory[record['user']] = record['worker']
+
+    def apply_logout(self, record: dict) -> None:
+        if self.directory.get(record['user']) == record['worker']:
+            del self.directory[record['user']]
+
+    def apply_history(self, record: dict) -> None:
+        messages = self.room_history(record['room']).since(
+            record['since'], record['limit'])
+        page = []
+        for message in messages:
+            page.append(b'[%d] ' % message.seq)
+            page.append(message.data)
+        self.reply(record, page)
+
+    def apply_replay(self, record: dict) -> None:
+        last_messages = self.unread(record['user'], record['room'],
+                                    record.get('reliable', False))
+        if last_messages:
+            self.reply(record, last_messages)
+
+    def apply_reply(self, record: dict) -> None:
+        session = self.origin(record)
+        if session is not None:
+            session.send(record['text'].encode())
+
+    def apply_received(self, record: dict) -> None:
+        username = record['user']
+        if record['id'] > self.client_ids.get(username, 0):
+            self.client_ids[username] = record['id']
+            self.log({'op': 'received', 'user': username, 'id': record['id']})
+
+    def apply_resume(self, record: dict) -> None:
+        record = {**record, 'op': 'resumed',
+                  'id': self.client_ids.get(record['user'], 0)}
+        if self.origin(record) is None and self.cluster is not None:
+            self.cluster.send(record['worker'], record)
+        else:
+            self.apply_resumed(record)
+
+    def apply_resumed(self, record: dict) -> None:
+        session = self.origin(record)
+        if session is None:
+            return
+        session.last_id = record['id']
+        session.send(b'CAPS %s\nACK %d\n' % (RELIABLE.encode(), record['id']))
+        self.greet(session, record['compress'])
+
+    def apply_subscribe(self, record: dict) -> None:
+        nodes = self.subscribers.setdefault(record['room'], set())
+        if record['op'] == 'subscribe':
+            nodes.add(record['worker'])
+        else:
+            nodes.discard(record['worker'])
+
+    def snapshot_state(self) -> dict:
+        rooms = {}
+        for room, history in self.histories().items():
+            if history.persistent:
+                history.flush()
+                messages = []
+            else:
+                messages = [message.row() for message in history]
+            rooms[room] = {'next_seq': history.next_seq, 'messages': messages}
+        return {
+            'rooms': rooms,
+            'access_codes': {room: dict(codes) for room, codes in
+                             self.access_codes.items()},
+            'cursors': {username: dict(rooms) for username, rooms in
+                        self.cursors.items()},
+            'client_ids': dict(self.client_ids),
+        }
+
+    def restore_state(self, state: dict) -> None:
+        for room, data in state['rooms'].items():
+            if room == GENERAL_ROOM and self.message_list.persistent:
+                self.message_list.close()
+            history = self.new_history(
+                room, map(Message.from_row, data['messages']),
+                data['next_seq'])
+            history.rewind(data['next_seq'])
+            if room == GENERAL_ROOM:
+                self.message_list = history
+            else:
+                self.channels[room] = set()
+                self.channels_message[room] = history
+        self.access_codes = state['access_codes']
+        self.cursors = state['cursors']
+        self.client_ids = state.get('client_ids', {})
+
+    def load_state(self, state: Optional[dict], records: list) -> None:
+        journal, self.journal = self.journal, None
+        try:
+            if state is not None:
+                self.restore_state(state)
+            else:
+                self.message_list.rewind(1)
+            for record in records:
+                self.apply(record)
+        finally:
+            self.journal = journal
+        self.logger.info(
+            f'Состояние восстановлено, записей журнала: {len(records)}')
+
+    async def start_cluster(self, node: Optional[str],
+                            peers: Optional[str]) -> None:
+        if node is None:
+            return
+        self.cluster = Cluster(node, peers.split(',') if peers else (),
+                               self.logger, self.apply)
+        self.node = self.cluster.node
+        await self.cluster.start()
+        await self.logger.info(
+            f'Node {node} waiting for {len(self.cluster.peers)} peers')
+        await self.cluster.ready.wait()
+
+    async def close_links(self) -> None:
+        if self.bus is not None:
+            await self.bus.close()
+        if self.cluster is not None:
+            await self.cluster.close()
+
+    async def listen(self, host: str, port: int, reuse_port: bool,
+                     takeover: Optional[dict]) -> asyncio.Server:
+        if takeover is None:
+            return await asyncio.start_server(
+                self.handle_client, host, port, reuse_port=reuse_port)
+        listener = await asyncio.start_server(
+            self.handle_client, sock=socket.socket(fileno=takeover['fds'][0]))
+        self.directory.update(takeover['directory'])
+        for data, fd in zip(takeover['sessions'], takeover['fds'][1:]):
+            await self.adopt(data, socket.socket(fileno=fd))
+        await self.logger.info(
+            f'Took over {len(takeover["sessions"])} connections')
+        return listener
+
+    async def adopt(self, data: dict, sock: socket.socket) -> None:
+        reader, writer = await asyncio.open_connection(sock=sock)
+        session = self.open_session(tuple(data['address']), writer)
+        session.decoder.buffer += data['buffer']
+        session.decoder.discarding = data['discarding']
+        session.reliable = data['reliable']
+        session.last_id = data['last_id']
+        if data['compressed']:
+            session.send(f'CAPS {COMPRESSION}\n'.encode())
+            session.outbox.start_compression()
+        if data['username'] is not None:
+            session.username = data['username']
+            self.users[session.username] = session
+        rooms = [room for room in data['rooms'] if room in self.channels]
+        for room in rooms:
+            self.channels[room].add(session)
+            session.rooms.add(room)
+        if rooms:
+            self.general.discard(session)
+        asyncio.create_task(self.serve_session(session, reader))
+
+    async def serve(self, listener: asyncio.Server,
+                    path: Optional[str]) -> None:
+        if path is None:
+            await listener.serve_forever()
+            return
+        loop = asyncio.get_running_loop()
+        control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        Path(path).unlink(missing_ok=True)
+        control.bind(path)
+        os.chmod(path, 0o600)
+        control.listen()
+        control.setblocking(False)
+        try:
+            while listener is not None:
+                conn, _ = await loop.sock_accept(control)
+                listener = await self.hand_off(conn, listener)
+        finally:
+            control.close()
+
+    async def hand_off(self, conn: socket.socket,
+                       listener: asyncio.Server) -> Optional[asyncio.Server]:
+        loop = asyncio.get_running_loop()
+        with_sessions = await loop.sock_recv(conn, 1) == WITH_SESSIONS
+        listen_fd = os.dup(listener.sockets[0].fileno())
+        listener.close()
+        paused = list(self.sessions.values()) if with_sessions else []
+        for session in paused:
+            session.outbox.writer.transport.pause_reading()
+        sessions = await self.quiesce(paused)
+        await self.close_rest(sessions)
+        state = {
+            'recovered': (self.snapshot_state(), [],
+                          self.journal.generation),
+            'directory': self.directory,
+            'sessions': [{'address': session.address,
+                          'username': session.username,
+                          'rooms': list(session.rooms),
+                          'compressed': session.outbox.compressor is not None,
+                          'reliable': session.reliable,
+                          'last_id': session.last_id,
+                          'buffer': bytes(session.decoder.buffer),
+                          'discarding': session.decoder.discarding}
+                         for session in sessions],
         }
-        with open('server_state.json', 'w') as file:
-            json.dump(data_to_save, file, indent=2)
-        self.logger.info('Состояние сохранено в файл')
-
-    def load_state_from_file(self):
-        with open('server_state.json', 'r') as file:
-            data_loaded = json.load(file)
-        self.message_list = data_loaded['message_list']
-        self.channels = {channel: [] for channel in
-                         data_loaded['channels'].keys()}
-        self.channels_message = {channel: messages for channel, messages
-                                 in data_loaded['channels_message'].items()}
-        self.usernames = {eval(address): username for address, username in
-                          data_loaded['usernames'].items()}
-        self.access_codes = data_loaded['access_codes']
-        self.logger.info('Состояние загружено из файла')
-
-
-async def main(host: str = HOST, port: int = PORT) -> None:
-    server_logger = await configure_server_logging()
-    server = Server(server_logger)
-    cleanup_task = asyncio.create_task(server.remove_old_messages())
-    server_coro = await asyncio.start_server(server.handle_client, host, port)
+        fds = [listen_fd, *(session.outbox.writer.get_extra_info(
+            'socket').fileno() for session in sessions)]
+        conn.setblocking(True)
+        try:
+            await asyncio.to_thread(send_handoff, conn, state, fds)
+        except OSError as e:
+            await self.logger.error(f'Handoff failed: {e}')
+            conn.close()
+            for session in paused:
+                if not session.outbox.writer.transport.is_closing():
+                    session.outbox.writer.transport.resume_reading()
+            return await asyncio.start_server(
+                self.handle_client, sock=socket.socket(fileno=listen_fd))
+        for session in sessions:
+            self.detach(session)
+        os.close(listen_fd)
+        self.handoff = conn
+        await self.logger.info(f'Handed off {len(sessions)} connections')
+        return None
+
+    async def quiesce(self, sessions: list,
+                      timeout: float = HANDOFF_TIMEOUT) -> list:
+        deadline = time.monotonic() + timeout
+        await asyncio.sleep(0)
+        while time.monotonic() < deadline and not all(
+                session.outbox.flushed() for session in sessions):
+            await asyncio.sleep(0.01)
+        return [session for session in sessions
+                if session.outbox.flushed()]
+
+    async def close_rest(self, keep: list) -> None:
+        keep = set(keep)
+        closing = [session for session in self.sessions.values()
+                   if session not in keep]
+        for session in closing:
+            self.close_session(session, b'SERVER_SHUTDOWN\n')
+        if not closing:
+            return
+        _, pending = await asyncio.wait(
+            [session.outbox.task for session in closing],
+            timeout=HANDOFF_TIMEOUT)
+        for session in closing:
+            if session.outbox.task in pending:
+                session.outbox.task.cancel()
+                session.outbox.writer.transport.abort()
+        if pending:
+            await asyncio.wait(pending)
+
+    def detach(self, session: Session) -> None:
+        self.sessions.pop(session.address, None)
+        session.outbox.closing = True
+        session.outbox.task.cancel()
+        session.outbox.writer.transport.abort()
+
+    def finish_handoff(self) -> None:
+        if self.handoff is not None:
+            self.handoff.close()
+            self.handoff = None
+
+
+async def main(host: str = HOST, port: int = PORT,
+               history_size: int = HISTORY_MAX_SIZE,
+               history_age: float = HISTORY_MAX_AGE,
+               state_dir: str = str(STATE_DIR),
+               workers: int = 1,
+               worker_id: int = 0,
+               bus_path: Optional[str] = None,
+               recovered: Optional[tuple] = None,
+               metrics_host: str = METRICS_HOST,
+               metrics_port: int = METRICS_PORT,
+               heartbeat_interval: float = HEARTBEAT_INTERVAL,
+               idle_timeout: float = IDLE_TIMEOUT,
+               outbound_buffer: int = OUTBOUND_BUFFER_SIZE,
+               write_buffer_high: int = WRITE_BUFFER_HIGH,
+               write_buffer_low: int = WRITE_BUFFER_LOW,
+               slow_consumer_policy: str = SLOW_CONSUMER_POLICY,
+               slow_consumer_timeout: float = SLOW_CONSUMER_TIMEOUT,
+               history_store: str = 'memory',
+               log_mode: str = 'async',
+               log_level: str = 'INFO',
+               log_sample: Optional[str] = None,
+               log_max_bytes: int = LOG_MAX_BYTES,
+               log_backups: int = LOG_BACKUPS,
+               cluster_listen: Optional[str] = None,
+               peers: Optional[str] = None,
+               handoff: Optional[str] = None,
+               handoff_listener_only: bool = False,
+               **limits) -> None:
+    server_logger = await configure_server_logging(
+        log_mode, log_level, log_sample, log_max_bytes, log_backups,
+        None if bus_path is None else worker_id)
+    stopping = asyncio.Event()
+    if bus_path is not None:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM,
+                                                      stopping.set)
+    journal = None
+    takeover = await take_over(handoff, not handoff_listener_only)
+    if worker_id == 0:
+        journal = Journal(Path(state_dir), server_logger)
+        recovered = journal.recover(
+            recovered if takeover is None else takeover['recovered'])
+    history_dir = None
+    if history_store == 'disk':
+        history_dir = Path(state_dir) / 'history' / f'worker{worker_id}'
+    server = Server(server_logger, history_size, history_age, journal,
+                    worker_id, Limiter(**limits),
+                    {'max_bytes': outbound_buffer,
+                     'policy': slow_consumer_policy,
+                     'stall_timeout': slow_consumer_timeout,
+                     'write_buffer': (write_buffer_high, write_buffer_low)},
+                    history_dir)
+    server.load_state(*recovered[:2])
+    tasks = [asyncio.create_task(stopping.wait()),
+             *server.start_persistence()]
+    if idle_timeout:
+        tasks.append(asyncio.create_task(
+            server.reap_idle(heartbeat_interval, idle_timeout)))
+    if metrics_port:
+        await server.metrics.start(metrics_host, metrics_port + worker_id)
+    if bus_path is not None:
+        server.bus = Bus(bus_path, server_logger, server.apply)
+        await server.bus.connect()
+        await server.bus.ready.wait()
+        tasks.append(asyncio.create_task(server.bus.closed.wait()))
+    await server.start_cluster(cluster_listen, peers)
+    server_coro = await server.listen(host, port, bus_path is not None,
+                                      takeover)
+    await server_logger.info(f'Worker {worker_id} serving on {host}:{port}')
 
     try:
         async with server_coro:
-            await server_coro.serve_forever()
+            tasks.append(asyncio.create_task(
+                server.serve(server_coro, handoff)))
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
     except asyncio.CancelledError:
-        cleanup_task.cancel()
+        pass
+    finally:
         server_logger.info('Server shutting down...')
-        for transport in server.connections.values():
-            transport.write(b'SERVER_SHUTDOWN\n')
-            transport.close()
+        await server.close_rest([])
         server_logger.info('Server stopped')
-    finally:
         server_logger.info('logger finished its work')
-        await server.save_state_to_file()
+        for task in tasks:
+            task.cancel()
+        await server.close_links()
+        server.close_histories()
+        if journal is not None:
+            await journal.close()
+        if metrics_port:
+            await server.metrics.close()
         await server_logger.shutdown()
+        server.finish_handoff()
+
+
+def stop_workers(pids: list) -> None:
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    while pids:
+        os.waitpid(pids.pop(), 0)
+
+
+async def run_hub(sock: socket.socket, workers: int, pids: list) -> None:
+    hub_logger = await configure_server_logging()
+    stopping = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM,
+                                                  stopping.set)
+    tasks = [asyncio.create_task(Hub(sock, workers, hub_logger).serve()),
+             asyncio.create_task(stopping.wait())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await asyncio.to_thread(stop_workers, pids)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await hub_logger.shutdown()
+
+
+def run_workers(workers: int, state_dir: str = str(STATE_DIR),
+                **options) -> None:
+    bus_dir = tempfile.mkdtemp(prefix='streem-')
+    bus_path = os.path.join(bus_dir, 'bus.sock')
+    hub_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    hub_socket.bind(bus_path)
+    hub_socket.listen()
+    recovered = read_journal(Path(state_dir))
+    pids = []
+    for worker_id in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            hub_socket.close()
+            exit_code = 0
+            try:
+                asyncio.run(main(state_dir=state_dir, workers=workers,
+                                 worker_id=worker_id, bus_path=bus_path,
+                                 recovered=recovered, **options))
+            except BaseException:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        pids.append(pid)
+    try:
+        asyncio.run(run_hub(hub_socket, workers, pids))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_workers(pids)
+        shutil.rmtree(bus_dir, ignore_errors=True)
 
 
 if __name__ == '__main__':
     parser = server_arg_parser()
     args = parser.parse_args()
+    if args.workers > 1 and args.cluster_listen is not None:
+        parser.error('--cluster-listen requires a single worker')
+    if args.handoff is not None and (args.workers > 1
+                                     or args.cluster_listen is not None):
+        parser.error('--handoff requires a single worker without a cluster')
     try:
-        asyncio.run(main(args.host, args.port))
+        if args.workers > 1:
+            run_workers(**vars(args))
+        else:
+            asyncio.run(main(**vars(args)))
     except KeyboardInterrupt:
         pass
@@ -0,0 +1,164 @@
+import asyncio
+import os
+import queue
+import sys
+import threading
+import time
+from logging import getLevelName
+from pathlib import Path
+from typing import Optional, TextIO, Union
+
+from constants import (LOG_BACKUPS, LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL,
+                       LOG_MAX_BYTES)
+
+
+class Done:
+    def __await__(self):
+        return iter(())
+
+
+DONE: Done = Done()
+
+
+def parse_samples(samples: Optional[str]) -> dict:
+    rates = {}
+    if samples:
+        for part in samples.split(','):
+            event, rate = part.split('=')
+            rates[event.strip()] = max(int(rate), 1)
+    return rates
+
+
+class ThreadLogger:
+    def __init__(self, name: str, path: Path,
+                 level: Union[int, str] = 'INFO',
+                 samples: Optional[dict] = None,
+                 max_bytes: int = LOG_MAX_BYTES,
+                 backups: int = LOG_BACKUPS,
+                 flush_interval: float = LOG_FLUSH_INTERVAL,
+                 batch_size: int = LOG_BATCH_SIZE,
+                 stream: Optional[TextIO] = sys.stdout) -> None:
+        self.name: str = name
+        self.path: Path = path
+        self.level: int = (level if isinstance(level, int)
+                           else getLevelName(level))
+        self.samples: dict = samples or {}
+        self.counters: dict = dict.fromkeys(self.samples, 0)
+        self.max_bytes: int = max_bytes
+        self.backups: int = backups
+        self.flush_interval: float = flush_interval
+        self.batch_size: int = batch_size
+        self.stream: Optional[TextIO] = stream
+        self.file: Optional[TextIO] = None
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.thread: threading.Thread = threading.Thread(
+            target=self.run, name=f'{name}-log', daemon=True)
+        self.thread.start()
+
+    def is_enabled_for(self, level: int) -> bool:
+        return level >= self.level
+
+    def sampled(self, event: str) -> bool:
+        rate = self.samples.get(event)
+        if rate is None:
+            return True
+        count = self.counters[event]
+        self.counters[event] = count + 1
+        return count % rate == 0
+
+    def log(self, level: int, msg: str, args: tuple,
+            extra: Optional[dict] = None) -> Done:
+        if level < self.level:
+            return DONE
+        if extra is not None and not self.sampled(extra.get('event')):
+            return DONE
+        self.queue.put((time.time(), level, msg, args))
+        return DONE
+
+    def debug(self, msg: str, *args, extra: Optional[dict] = None,
+              **kwargs) -> Done:
+        return self.log(10, msg, args, extra)
+
+    def info(self, msg: str, *args, extra: Optional[dict] = None,
+             **kwargs) -> Done:
+        return self.log(20, msg, args, extra)
+
+    def warning(self, msg: str, *args, extra: Optional[dict] = None,
+                **kwargs) -> Done:
+        return self.log(30, msg, args, extra)
+
+    def error(self, msg: str, *args, extra: Optional[dict] = None,
+              **kwargs) -> Done:
+        return self.log(40, msg, args, extra)
+
+    def critical(self, msg: str, *args, extra: Optional[dict] = None,
+                 **kwargs) -> Done:
+        return self.log(50, msg, args, extra)
+
+    @staticmethod
+    def format(record: tuple) -> str:
+        created, level, msg, args = record
+        if len(args) == 1 and isinstance(args[0], dict):
+            args = args[0]
+        if args:
+            msg = msg % args
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created))
+        return (f'{stamp},{int(created % 1 * 1000):03d} - '
+                f'[{getLevelName(level)}] - {msg}\n')
+
+    def collect(self) -> tuple:
+        record = self.queue.get()
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while record is not None:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                break
+            timeout = deadline - time.monotonic()
+            try:
+                record = (self.queue.get(timeout=timeout) if timeout > 0
+                          else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch, record is None
+
+    def write(self, batch: list) -> None:
+        text = ''.join(map(self.format, batch))
+        if self.stream is not None:
+            self.stream.write(text)
+            self.stream.flush()
+        if self.file is None:
+            self.file = open(self.path, 'a', encoding='utf-8')
+        self.file.write(text)
+        self.file.flush()
+        if self.max_bytes and self.file.tell() >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self) -> None:
+        self.file.close()
+        self.file = None
+        for number in range(self.backups - 1, 0, -1):
+            source = self.path.with_name(f'{self.path.name}.{number}')
+            if source.exists():
+                os.replace(source, self.path.with_name(
+                    f'{self.path.name}.{number + 1}'))
+        if self.backups:
+            os.replace(self.path, self.path.with_name(f'{self.path.name}.1'))
+        else:
+            self.path.unlink()
+
+    def run(self) -> None:
+        stopped = False
+        while not stopped:
+            batch, stopped = self.collect()
+            try:
+                if batch:
+                    self.write(batch)
+            except (OSError, ValueError, TypeError) as e:
+                sys.stderr.write(f'Logging failed: {e}\n')
+        if self.file is not None:
+            self.file.close()
+
+    async def shutdown(self) -> None:
+        self.queue.put(None)
+        await asyncio.to_thread(self.thread.join)